@@ -63,6 +63,19 @@ def execute_command(logger, connection, command: str, params: tuple = None) -> N
         connection.rollback()
         raise
 
+# Columns concatenated, in order, into the key hashed for event_signature
+EVENT_SIGNATURE_COLUMNS = ['tx_timestamp', 'tx_hash', 'address', 'gmv', 'role', 'row_number']
+HASH_CHUNK_ROWS = 100000
+
+def compute_event_signatures(df):
+    """Hash EVENT_SIGNATURE_COLUMNS for every row, byte-identical to the old per-row f-string."""
+    columns = [df[col].map(str).tolist() for col in EVENT_SIGNATURE_COLUMNS]
+    keys = [''.join(parts) for parts in zip(*columns)]
+    digests = []
+    for start in range(0, len(keys), HASH_CHUNK_ROWS):
+        digests.extend(hashlib.sha256(key.encode()).hexdigest() for key in keys[start:start + HASH_CHUNK_ROWS])
+    return pd.Series(digests, index=df.index)
+
 def refresh_dune_table(dune_api_key, logger):
     try:
         # Initialize Dune client and get query results
@@ -78,12 +91,7 @@ def refresh_dune_table(dune_api_key, logger):
         query_result_df['row_number'] = range(1, len(query_result_df) + 1)
         
         # Create hash_id by concatenating and hashing relevant columns
-        query_result_df['event_signature'] = query_result_df.apply(
-            lambda row: hashlib.sha256(
-                f"{row['tx_timestamp']}{row['tx_hash']}{row['address']}{row['gmv']}{row['role']}{row['row_number']}".encode()
-            ).hexdigest(),
-            axis=1
-        )
+        query_result_df['event_signature'] = compute_event_signatures(query_result_df)
 
         # validation
         if len(query_result_df) == 0:
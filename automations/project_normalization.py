@@ -0,0 +1,86 @@
+"""Vectorized normalization of project attributes used to match projects across sources.
+
+Columns are converted to Arrow-backed strings, so every transform runs in pyarrow and
+missing values stay missing instead of turning into the strings 'nan' or 'None'. The
+regular expressions are RE2 patterns, which is what pyarrow evaluates.
+"""
+import pandas as pd
+
+ARROW_STRING = 'string[pyarrow]'
+
+ETH_ADDRESS_PATTERN = r'^0x[0-9a-f]{40}$'
+# Python's \w and \s match any Unicode letter, digit or space, RE2's only ASCII ones
+TITLE_PUNCTUATION_PATTERN = r'[^\p{L}\p{M}\p{N}_\s\p{Z}]'
+WHITESPACE_PATTERN = r'[\s\p{Z}]+'
+GITHUB_URL_PATTERN = r'^(https?://)?(www\.)?github\.com/'
+TWITTER_URL_PATTERN = r'^(https?://)?(www\.|mobile\.)?(twitter|x)\.com/'
+WEBSITE_SCHEME_PATTERN = r'^(https?://)?(www\.)?'
+PATH_PATTERN = r'[/?#].*$'
+
+
+def to_arrow_strings(values: pd.Series) -> pd.Series:
+    """Trimmed Arrow-backed strings, with empty values as missing."""
+    values = values.astype(ARROW_STRING).str.strip()
+    return values.where((values.str.len() > 0).fillna(False))
+
+
+def normalize_title(values: pd.Series) -> pd.Series:
+    """Lowercase, drop punctuation and collapse whitespace.
+
+    >>> normalize_title(pd.Series(['Café\\xa0Bar!', 'Foo \\u2003 bar', None])).tolist()
+    ['café bar', 'foo bar', <NA>]
+    """
+    values = to_arrow_strings(values).str.lower()
+    values = values.str.replace(TITLE_PUNCTUATION_PATTERN, '', regex=True)
+    values = values.str.replace(WHITESPACE_PATTERN, ' ', regex=True)
+    return to_arrow_strings(values)
+
+
+def normalize_github(values: pd.Series) -> pd.Series:
+    """GitHub user or organization from a handle, 'owner/repo' or a github.com URL."""
+    values = to_arrow_strings(values).str.lower()
+    values = values.str.replace(GITHUB_URL_PATTERN, '', regex=True)
+    values = values.str.replace(PATH_PATTERN, '', regex=True)
+    return to_arrow_strings(values.str.lstrip('@'))
+
+
+def normalize_twitter(values: pd.Series) -> pd.Series:
+    """Twitter handle without '@', from a handle or a twitter.com or x.com URL."""
+    values = to_arrow_strings(values).str.lower()
+    values = values.str.replace(TWITTER_URL_PATTERN, '', regex=True)
+    values = values.str.replace(PATH_PATTERN, '', regex=True)
+    return to_arrow_strings(values.str.lstrip('@'))
+
+
+def normalize_website(values: pd.Series) -> pd.Series:
+    """Website without scheme, 'www.' or trailing slashes.
+
+    The path is kept: many projects share a host such as github.com or linktr.ee.
+    """
+    values = to_arrow_strings(values).str.lower()
+    values = values.str.replace(WEBSITE_SCHEME_PATTERN, '', regex=True)
+    return to_arrow_strings(values.str.rstrip('/'))
+
+
+def normalize_address(values: pd.Series) -> pd.Series:
+    """Lowercase Ethereum address, or missing if the value isn't one."""
+    values = to_arrow_strings(values).str.lower()
+    return values.where(values.str.match(ETH_ADDRESS_PATTERN).fillna(False))
+
+
+NORMALIZERS = {
+    'title': normalize_title,
+    'website': normalize_website,
+    'payout_address': normalize_address,
+    'project_twitter': normalize_twitter,
+    'project_github': normalize_github
+}
+
+
+def normalize_project_attributes(data: pd.DataFrame) -> pd.DataFrame:
+    """Normalize every attribute column in NORMALIZERS that data has, returning a copy."""
+    data = data.copy()
+    for column, normalize in NORMALIZERS.items():
+        if column in data.columns:
+            data[column] = normalize(data[column])
+    return data
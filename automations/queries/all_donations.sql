@@ -52,7 +52,9 @@ grants_stack_donations AS (
         AND gsg.chain_id = d.chain_id
     WHERE d.chain_id != 11155111
 )
-SELECT 
+-- static_donations only holds CGrants and Alpha rows, so it never overlaps the Grants Stack
+-- rows and the halves are combined with UNION ALL
+SELECT DISTINCT
     encode(
         digest(
             round_num::text || donor_address || amount_in_usd::text || recipient_address || 
@@ -74,26 +76,5 @@ SELECT
     'GrantsStack' AS source
 FROM 
     grants_stack_donations
-UNION 
-SELECT 
-    encode(
-        digest(
-            round_num::text || donor_address || amount_in_usd::text || recipient_address || 
-            timestamp::text || project_id || round_id || chain_id::text,
-            'sha256'
-        ),
-        'hex'
-    ) AS donation_id,
-    round_num::text,
-    round_name,
-    donor_address,
-    amount_in_usd,
-    recipient_address,
-    timestamp,
-    project_name,
-    project_id,
-    round_id,
-    chain_id,
-    source
-FROM 
-    static_donations
+UNION ALL
+SELECT * FROM etl_state.static_donations_ids
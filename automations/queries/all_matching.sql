@@ -24,8 +24,9 @@ WITH gg_rounds AS (
   LEFT JOIN gg_rounds gg 
     ON gg.chain_id = im.chain_id 
     AND LOWER(gg.round_id) = im.round_id
-  )
-SELECT 
+  ),
+grants_stack_rows AS (
+SELECT DISTINCT
     encode(
         digest(
              title || match_amount_in_usd::text || recipient_address || 
@@ -44,23 +45,16 @@ SELECT
     timestamp
 FROM 
     grants_stack_matching
-UNION
-SELECT
-    encode(
-        digest(
-            round_num::text || title || match_amount_usd::text || payoutaddress || 
-            project_id || round_id || chain_id::text,
-            'sha256'
-        ),
-        'hex'
-    ) AS matching_id,
-    round_num::text,
-    title,
-    match_amount_usd as match_amount_in_usd,
-    payoutaddress as recipient_address,
-    project_id,
-    round_id,
-    chain_id,
-    timestamp
-FROM 
-    static_matching
+)
+-- Live rows identical to a static row are dropped, as the UNION used to do, by looking
+-- them up on the static ids
+SELECT * FROM grants_stack_rows l
+WHERE NOT EXISTS (
+    SELECT 1 FROM etl_state.static_matching_ids s
+    WHERE s.matching_id = l.matching_id
+    AND (s.round_num, s.title, s.match_amount_in_usd, s.recipient_address, s.project_id, s.round_id, s.chain_id, s.timestamp)
+        IS NOT DISTINCT FROM
+        (l.round_num, l.title, l.match_amount_in_usd, l.recipient_address, l.project_id, l.round_id, l.chain_id, l.timestamp)
+)
+UNION ALL
+SELECT * FROM etl_state.static_matching_ids
@@ -58,13 +58,13 @@ donations_summary AS (
             WHEN strategy_name = '' THEN 'allov1.QF'
             ELSE strategy_name 
         END as strategy_name,
-        (r.round_metadata #>> '{name}')::TEXT AS round_name,
+        r.round_name,
         d.transaction_hash as tx_hash,
         d.timestamp::timestamp with time zone as tx_timestamp,
         SUM(d.amount_in_usd) AS total_amount_in_usd
-    FROM donations d
+    FROM leaderboard_donation_rollup d
     LEFT JOIN chain_mapping cm ON cm.chain_id = d.chain_id
-    LEFT JOIN rounds r on r.id = d.round_id AND r.chain_id = d.chain_id
+    LEFT JOIN leaderboard_round_dim r on r.round_id = d.round_id AND r.chain_id = d.chain_id
     GROUP BY 1,2,3,4,5,6,7
 ),
 
@@ -149,7 +149,7 @@ donation_donor_grantee_gmv AS (
     SELECT 
         cm.chain_name AS blockchain,
         d.chain_id,
-        (r.round_metadata #>> '{name}')::TEXT AS pool_name,
+        r.round_name AS pool_name,
         d.round_id,
         d.timestamp::timestamp with time zone AS tx_timestamp,
         d.transaction_hash AS tx_hash,
@@ -170,7 +170,7 @@ donation_donor_grantee_gmv AS (
             donor_address AS address,
             'donor' AS role,
             SUM(amount_in_usd) AS gmv
-        FROM donations
+        FROM leaderboard_donation_rollup
         GROUP BY 1, 2, 3, 4, 5, 6
         
         UNION ALL
@@ -184,11 +184,11 @@ donation_donor_grantee_gmv AS (
             recipient_address AS address,
             'grantee' AS role,
             SUM(amount_in_usd) AS gmv
-        FROM donations
+        FROM leaderboard_donation_rollup
         GROUP BY 1, 2, 3, 4, 5, 6
     ) d
     LEFT JOIN chain_mapping cm ON cm.chain_id = d.chain_id
-    LEFT JOIN rounds r on r.id = d.round_id AND r.chain_id = d.chain_id
+    LEFT JOIN leaderboard_round_dim r on r.round_id = d.round_id AND r.chain_id = d.chain_id
 ),
 
 -- STREAM 2: DISTRIBUTIONS --
@@ -205,37 +205,14 @@ distribution_base AS (
         strategy_id,
         strategy_name,
         'matching' as source_type
-    FROM (
-        SELECT 
-            r.id AS round_id,
-            r.chain_id,
-            (r.round_metadata #>> '{name}')::TEXT AS round_name,
-            COALESCE((TO_TIMESTAMP(r.matching_distribution->>'blockTimestamp', 'YYYY-MM-DD"T"HH24:MI:SS.MSZ')),donations_end_time) AS timestamp,
-            md.value->>'projectName' AS project_name,
-            md.value->>'projectPayoutAddress' AS recipient_address,
-            a.distribution_transaction as transaction_hash,
-            CASE 
-                WHEN r.id = '0xa1d52f9b5339792651861329a046dd912761e9a9' 
-                THEN (CAST(md.value->>'matchPoolPercentage' AS NUMERIC) * r.match_amount_in_usd)/1000000000000 
-                ELSE (CAST(md.value->>'matchPoolPercentage' AS NUMERIC) * r.match_amount_in_usd)
-            END AS amount_in_usd,
-            strategy_id,
-            strategy_name
-        FROM rounds r
-        CROSS JOIN LATERAL jsonb_array_elements(r.matching_distribution->'matchingDistribution') AS md(value)
-        LEFT JOIN applications a 
-            ON a.chain_id = r.chain_id 
-            AND a.round_id = r.id 
-            AND a.id = (md.value->>'applicationId')
-        WHERE r.chain_id != 11155111
-    ) matching
+    FROM leaderboard_matching_distribution
     
     UNION ALL
     
     SELECT 
         ap.chain_id,
         ap.round_id,
-        (r.round_metadata #>> '{name}')::TEXT AS round_name,
+        r.round_name,
         timestamp::timestamp with time zone,
         (a."metadata" #>> '{application, project, title}')::text AS project_name,
         (a."metadata" #>> '{application, recipient}')::text AS recipient_address,
@@ -249,9 +226,9 @@ distribution_base AS (
         ON a.chain_id = ap.chain_id 
         AND a.round_id = ap.round_id 
         AND a.id = ap.application_id
-    LEFT JOIN rounds r 
+    LEFT JOIN leaderboard_round_dim r 
         ON ap.chain_id = r.chain_id 
-        AND r.id = ap.round_id
+        AND r.round_id = ap.round_id
     WHERE amount_in_usd > 0
 ),
 
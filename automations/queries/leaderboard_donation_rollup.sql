@@ -0,0 +1,12 @@
+-- Donations rolled up per transaction, donor and recipient. The leaderboard's
+-- per-transaction, donor and grantee totals all re-aggregate this instead of donations
+SELECT
+    d.chain_id,
+    d.round_id,
+    d.timestamp,
+    d.transaction_hash,
+    d.donor_address,
+    d.recipient_address,
+    SUM(d.amount_in_usd) AS amount_in_usd
+FROM donations d
+GROUP BY 1, 2, 3, 4, 5, 6
@@ -0,0 +1,20 @@
+-- Matching payouts from rounds.matching_distribution, one row per project
+SELECT 
+    i.round_id,
+    i.chain_id,
+    (r.round_metadata #>> '{name}')::TEXT AS round_name,
+    COALESCE(i.timestamp, r.donations_end_time) AS timestamp,
+    i.project_name,
+    i.project_payout_address AS recipient_address,
+    a.distribution_transaction as transaction_hash,
+    i.match_amount_in_usd AS amount_in_usd,
+    r.strategy_id,
+    r.strategy_name
+FROM etl_state.matching_distribution_items i
+JOIN rounds r 
+    ON r.id = i.round_id 
+    AND r.chain_id = i.chain_id
+LEFT JOIN applications a 
+    ON a.chain_id = i.chain_id 
+    AND a.round_id = i.round_id 
+    AND a.id = i.application_id
@@ -0,0 +1,8 @@
+-- Round attributes shared by the leaderboard streams, one row per round
+SELECT
+    r.chain_id,
+    r.id AS round_id,
+    (r.round_metadata #>> '{name}')::TEXT AS round_name,
+    r.strategy_id,
+    r.strategy_name
+FROM rounds r
@@ -12,18 +12,17 @@ WITH program_data AS (
         AND LOWER("round_id") NOT IN ('0x911ae126be7d88155aa9254c91a49f4d85b83688', '0x40511f88b87b69496a3471cdbe1d3d25ac68e408', '0xc08008d47e3deb10b27fc1a75a96d97d11d58cf8', '0xb5c0939a9bb0c404b028d402493b86d9998af55e')
 ),
 
+-- Per-round MACI contribution stats, recomputed only for rounds with new contributions
 maci_round_stats AS (
     SELECT
         round_id,
         chain_id,
-        SUM(voice_credit_balance) / 100000 * 3000 as USD,
-        COUNT(DISTINCT contributor_address) as unique_donors,
-        COUNT(DISTINCT transaction_hash) as transactions,
-        MAX(timestamp) as latest_contribution
+        USD,
+        unique_donors,
+        transactions,
+        latest_contribution
     FROM
-        maci."contributions"
-    GROUP BY
-        round_id, chain_id
+        etl_state.maci_round_stats
 ),
 
 direct_grants AS (
@@ -33,7 +32,7 @@ direct_grants AS (
         SUM(amount_in_usd) as direct_grants_payout,
         MAX(timestamp) as last_payout_time
     FROM
-        "public"."applications_payouts"
+        applications_payouts
     WHERE 
         chain_id != 11155111
     GROUP BY    
@@ -0,0 +1,24 @@
+-- The static half of all_donations with its ids. Stored once in etl_state.static_donations_ids
+-- and rebuilt only when static_donations changes
+SELECT DISTINCT
+    encode(
+        digest(
+            round_num::text || donor_address || amount_in_usd::text || recipient_address || 
+            timestamp::text || project_id || round_id || chain_id::text,
+            'sha256'
+        ),
+        'hex'
+    ) AS donation_id,
+    round_num::text,
+    round_name,
+    donor_address,
+    amount_in_usd,
+    recipient_address,
+    timestamp,
+    project_name,
+    project_id,
+    round_id,
+    chain_id,
+    source
+FROM 
+    static_donations
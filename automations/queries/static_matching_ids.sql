@@ -0,0 +1,21 @@
+-- The static half of all_matching with its ids. Stored once in etl_state.static_matching_ids
+-- and rebuilt only when static_matching changes
+SELECT DISTINCT
+    encode(
+        digest(
+            round_num::text || title || match_amount_usd::text || payoutaddress || 
+            project_id || round_id || chain_id::text,
+            'sha256'
+        ),
+        'hex'
+    ) AS matching_id,
+    round_num::text,
+    title,
+    match_amount_usd as match_amount_in_usd,
+    payoutaddress as recipient_address,
+    project_id,
+    round_id,
+    chain_id,
+    timestamp
+FROM 
+    static_matching
@@ -4,6 +4,8 @@ import psycopg2 as pg
 import pandas as pd
 import logging
 import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Optional, List
 from datetime import datetime, timedelta
 import requests
@@ -22,15 +24,44 @@ try:
 except ImportError:
     logger.info("dotenv not installed, skipping .env file loading")
 
+# In snapshot mode the foreign tables are imported into <name>_fdw, and <name> holds local
+# copies of them, reloaded on every run with COPY straight from the source database
+SNAPSHOT_MODE = os.getenv('FOREIGN_SNAPSHOT_MODE', 'false').lower() == 'true'
+SNAPSHOT_WORKERS = int(os.getenv('FOREIGN_SNAPSHOT_WORKERS', '4'))
+SNAPSHOT_STAGING_SCHEMA = 'snapshot_staging'
+
+# postgres_fdw server options applied to every source server. fetch_size is the number of
+# rows pulled per round trip (postgres_fdw defaults to 100)
+DEFAULT_FDW_PROFILE = {
+    'fetch_size': '10000',
+    'use_remote_estimate': 'true',
+    'async_capable': 'true',
+    'analyze_sampling': 'auto'
+}
+
+# Local server_version_num from which postgres_fdw accepts an option. Older servers skip it
+FDW_OPTION_MIN_VERSIONS = {
+    'async_capable': 140000,
+    'analyze_sampling': 160000
+}
+
+# Schema version probes run concurrently and are cut off after PROBE_TIMEOUT_SECONDS, so a
+# busy source database can't stall the run. Indexer versions are compared on the donations
+# of the last PROBE_WINDOW_DAYS only
+PROBE_TIMEOUT_SECONDS = int(os.getenv('SCHEMA_PROBE_TIMEOUT_SECONDS', '60'))
+PROBE_WINDOW_DAYS = int(os.getenv('SCHEMA_PROBE_WINDOW_DAYS', '30'))
+
 class DatabaseConfig:
-    def __init__(self, name: str, tables_config: Dict, db_params: Dict):
+    def __init__(self, name: str, tables_config: Dict, db_params: Dict, fdw_profile: Optional[Dict] = None):
         self.name = name
         self.server = name
         self.schema = name
+        self.foreign_schema = f"{name}_fdw" if SNAPSHOT_MODE else name
         self.tables_to_drop = tables_config.get('drop', [])
         self.tables_to_import = tables_config.get('import', [])
         self.tables_to_create = tables_config.get('create', [])
         self.db_params = db_params
+        self.fdw_profile = {**DEFAULT_FDW_PROFILE, **(fdw_profile or {})}
 
 # Configuration for different database targets
 MACI_CONFIG = DatabaseConfig(
@@ -87,6 +118,10 @@ INDEXER_CONFIG = DatabaseConfig(
         'dbname': os.getenv('INDEXER_DB_NAME'),
         'user': os.getenv('INDEXER_DB_USER'),
         'password': os.getenv('INDEXER_DB_PASSWORD')
+    },
+    # donations is the largest table we pull, so fewer, larger round trips pay off most here
+    fdw_profile={
+        'fetch_size': '50000'
     }
 )
 
@@ -268,6 +303,41 @@ def create_table_from_definition(
     )
     execute_command(create_command, db_params)
 
+def apply_fdw_profile(config: DatabaseConfig, db_params: Dict) -> None:
+    """Set the config's postgres_fdw options on its server, adding the ones not set yet."""
+    current = run_query(f"""
+    SELECT option_name, option_value
+    FROM pg_foreign_server, pg_options_to_table(srvoptions)
+    WHERE srvname = '{config.server}';
+    """, db_params)
+    current_options = {} if current is None else dict(zip(current['option_name'], current['option_value']))
+    version = run_query("SELECT current_setting('server_version_num')::int AS version_num;", db_params)
+    version_num = None if version is None else int(version['version_num'][0])
+
+    unsupported = [
+        option for option in config.fdw_profile
+        if version_num is not None and version_num < FDW_OPTION_MIN_VERSIONS.get(option, 0)
+    ]
+    if unsupported:
+        logger.warning(f"Skipping {', '.join(unsupported)} on server {config.server}: not supported by Postgres {version_num}")
+
+    for option, value in config.fdw_profile.items():
+        if option in unsupported or current_options.get(option) == value:
+            continue
+        action = 'SET' if option in current_options else 'ADD'
+        logger.info(f"Setting {option} = {value} on server {config.server}")
+        execute_command(f"ALTER SERVER {config.server} OPTIONS ({action} {option} '{value}');", db_params)
+
+def analyze_foreign_tables(config: DatabaseConfig, db_params: Dict) -> None:
+    """Collect planner statistics for freshly imported foreign tables."""
+    for table in config.tables_to_import + config.tables_to_create:
+        logger.info(f"Analyzing {config.foreign_schema}.{table}")
+        execute_command(f"ANALYZE {config.foreign_schema}.{table};", db_params)
+
+def with_statement_timeout(db_params: Dict) -> Dict:
+    """Connection parameters that cancel any statement running past PROBE_TIMEOUT_SECONDS."""
+    return {**db_params, 'options': f'-c statement_timeout={PROBE_TIMEOUT_SECONDS * 1000}'}
+
 def get_maci_latest_schema_version(db_params: Dict) -> Optional[int]:
     """Get the latest schema version from the database, supporting 2 or 3 digit versions."""
     version_query = '''
@@ -277,7 +347,7 @@ def get_maci_latest_schema_version(db_params: Dict) -> Optional[int]:
        information_schema.tables
     WHERE table_schema LIKE 'chain_data___' OR table_schema LIKE 'chain_data____';
     '''
-    version_result = run_query(version_query, db_params)
+    version_result = run_query(version_query, with_statement_timeout(db_params))
     if version_result is None or version_result.empty:
         logger.error("No schema version found in the database")
         return None
@@ -286,64 +356,215 @@ def get_maci_latest_schema_version(db_params: Dict) -> Optional[int]:
     logger.info(f"Found latest schema version: {version}")
     return version
 
+def probe_indexer_version(version: int, db_params: Dict) -> Optional[float]:
+    """Sum the recent donations of one indexer version, or None if the probe fails or times out."""
+    schema_name = f'chain_data_{version}'
+    # Bounded to a recent window: a version that is still catching up is missing exactly these
+    query = f"""
+        SELECT
+            MAX(timestamp) AS latest_timestamp,
+            COUNT(*) AS num_donations,
+            SUM(amount_in_usd) AS sum_amount_in_usd
+        FROM {schema_name}.donations
+        WHERE chain_id != 11155111
+          AND timestamp >= now() - interval '{PROBE_WINDOW_DAYS} days';
+    """
+    result = run_query(query, with_statement_timeout(db_params))
+    if result is None or result.empty:
+        return None
+    row = result.iloc[0]
+    if row['latest_timestamp'] is None or row['sum_amount_in_usd'] is None:
+        return None
+    logger.info(f"{schema_name}: {row['num_donations']} donations worth ${row['sum_amount_in_usd']:,.0f} in the last {PROBE_WINDOW_DAYS} days")
+    return row['sum_amount_in_usd']
+
 def get_indexer_version_with_most_data(db_params: Dict) -> Optional[int]:
     """Get the chain data version with the most complete data."""
     latest_version_url = 'https://grants-stack-indexer-v2.gitcoin.co/version'
     try:
-        current_version = int(requests.get(latest_version_url).text.strip())
+        current_version = int(requests.get(latest_version_url, timeout=PROBE_TIMEOUT_SECONDS).text.strip())
     except Exception as e:
         logger.error(f"Failed to retrieve latest indexer version from {latest_version_url}: {e}")
         return None
 
     candidate_versions = [current_version, current_version - 1]
+    with ThreadPoolExecutor(max_workers=len(candidate_versions)) as executor:
+        sums = list(executor.map(lambda ver: probe_indexer_version(ver, db_params), candidate_versions))
+
     best_version = None
     best_sum_usd = 0
+    for ver, sum_usd in zip(candidate_versions, sums):
+        if sum_usd is not None and sum_usd > best_sum_usd:
+            best_sum_usd = sum_usd
+            best_version = ver
 
-    for ver in candidate_versions:
-        schema_name = f'chain_data_{ver}'
-        query = f"""
-            WITH ver_data AS (
-                SELECT 
-                    '{schema_name}' AS schema_name,
-                    MAX(timestamp) AS latest_timestamp,
-                    COUNT(*) AS num_donations,
-                    SUM(amount_in_usd) AS sum_amount_in_usd
-                FROM {schema_name}.donations
-                WHERE chain_id != 11155111
-                  AND timestamp >= CAST('2024-09-01' AS TIMESTAMP)
+    return best_version
+
+def probe_schema_version(config: DatabaseConfig) -> Optional[int]:
+    """Find the schema version a source database should be imported from."""
+    if config.name == 'indexer':
+        return get_indexer_version_with_most_data(config.db_params)
+    return get_maci_latest_schema_version(config.db_params)
+
+def get_table_columns(schema: str, table: str, db_params: Dict) -> List[str]:
+    """List a table's columns in order."""
+    columns = run_query(f"""
+    SELECT column_name
+    FROM information_schema.columns
+    WHERE table_schema = '{schema}' AND table_name = '{table}'
+    ORDER BY ordinal_position;
+    """, db_params)
+    if columns is None or columns.empty:
+        raise ValueError(f"No columns found for {schema}.{table}")
+    return columns['column_name'].tolist()
+
+def move_foreign_tables_aside(config: DatabaseConfig) -> None:
+    """Move foreign tables imported before snapshot mode was enabled into the foreign schema.
+
+    Views built on them keep reading them there until they are next rebuilt.
+    """
+    with pg.connect(**DB_PARAMS) as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE SCHEMA IF NOT EXISTS {config.foreign_schema};")
+            for table in config.tables_to_import + config.tables_to_create:
+                cur.execute(
+                    "SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+                    "WHERE n.nspname = %s AND c.relname = %s AND c.relkind = 'f'",
+                    (config.schema, table)
+                )
+                if cur.fetchone() is None:
+                    continue
+                logger.info(f"Moving foreign table {config.schema}.{table} to {config.foreign_schema}")
+                cur.execute(f"DROP FOREIGN TABLE IF EXISTS {config.foreign_schema}.{table} CASCADE;")
+                cur.execute(f"ALTER FOREIGN TABLE {config.schema}.{table} SET SCHEMA {config.foreign_schema};")
+        conn.commit()
+
+def get_chain_partitions(config: DatabaseConfig, remote_schema: str) -> List[str]:
+    """Split the chains of a source database into one filter per snapshot worker."""
+    chains = run_query(f"SELECT DISTINCT chain_id FROM {remote_schema}.rounds ORDER BY chain_id;", config.db_params)
+    if chains is None or chains.empty:
+        return ['TRUE']
+    chain_ids = [int(chain_id) for chain_id in chains['chain_id']]
+    groups = [chain_ids[i::SNAPSHOT_WORKERS] for i in range(min(SNAPSHOT_WORKERS, len(chain_ids)))]
+    partitions = [f"chain_id IN ({', '.join(map(str, group))})" for group in groups]
+    # Rows of chains without rounds, or without a chain, still have to end up somewhere
+    partitions.append(f"(chain_id NOT IN ({', '.join(map(str, chain_ids))}) OR chain_id IS NULL)")
+    return partitions
+
+def copy_partition(config: DatabaseConfig, query: str, staging_table: str, column_list: str) -> None:
+    """Stream one partition from the source database into a local staging table."""
+    # Connect before the exporter starts, so a failed connect can't leave it blocked on the pipe
+    conn = pg.connect(**DB_PARAMS)
+    read_fd, write_fd = os.pipe()
+    export_errors = []
+
+    def export() -> None:
+        try:
+            with os.fdopen(write_fd, 'wb') as pipe:
+                source = pg.connect(**config.db_params)
+                try:
+                    with source.cursor() as cur:
+                        cur.copy_expert(f"COPY ({query}) TO STDOUT", pipe)
+                finally:
+                    source.close()
+        except Exception as e:
+            export_errors.append(e)
+
+    exporter = threading.Thread(target=export)
+    exporter.start()
+    try:
+        # Closing the read end on failure makes the exporter stop instead of blocking on a full pipe
+        with os.fdopen(read_fd, 'rb') as pipe:
+            with conn.cursor() as cur:
+                cur.copy_expert(f"COPY {staging_table} ({column_list}) FROM STDIN", pipe)
+        exporter.join()
+        # A failed export closes the pipe early, which would otherwise look like a complete copy
+        if export_errors:
+            raise export_errors[0]
+        conn.commit()
+    finally:
+        exporter.join()
+        conn.close()
+
+def snapshot_table(config: DatabaseConfig, remote_schema: str, table: str, partitions: List[str]) -> None:
+    """Reload a local copy of a foreign table from an unlogged staging table filled in parallel."""
+    local_table = f"{config.schema}.{table}"
+    foreign_table = f"{config.foreign_schema}.{table}"
+    staging_table = f"{SNAPSHOT_STAGING_SCHEMA}.{config.name}_{table}"
+    columns = get_table_columns(config.foreign_schema, table, DB_PARAMS)
+    column_list = ', '.join(f'"{column}"' for column in columns)
+
+    with pg.connect(**DB_PARAMS) as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+            CREATE SCHEMA IF NOT EXISTS {SNAPSHOT_STAGING_SCHEMA};
+            DROP TABLE IF EXISTS {staging_table};
+            CREATE UNLOGGED TABLE {staging_table} (LIKE {foreign_table});
+            CREATE TABLE IF NOT EXISTS {local_table} (LIKE {foreign_table});
+            """)
+        conn.commit()
+
+    logger.info(f"Copying {remote_schema}.{table} into {staging_table} in {len(partitions)} partitions")
+    with ThreadPoolExecutor(max_workers=SNAPSHOT_WORKERS) as executor:
+        futures = [
+            executor.submit(
+                copy_partition, config,
+                f"SELECT {column_list} FROM {remote_schema}.{table} WHERE {partition}",
+                staging_table, column_list
             )
-            SELECT latest_timestamp, num_donations, sum_amount_in_usd
-            FROM ver_data;
-        """
-        result = run_query(query, db_params)
-        if result is not None and not result.empty:
-            row = result.iloc[0]
-            if row['latest_timestamp'] is not None and row['sum_amount_in_usd'] is not None:
-                if row['sum_amount_in_usd'] > best_sum_usd:
-                    best_sum_usd = row['sum_amount_in_usd']
-                    best_version = ver
+            for partition in partitions
+        ]
+        for future in futures:
+            future.result()
 
-    return best_version
+    # Views keep a dependency on the local table, so it is reloaded in place rather than replaced
+    with pg.connect(**DB_PARAMS) as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"TRUNCATE {local_table};")
+            cur.execute(f"INSERT INTO {local_table} ({column_list}) SELECT {column_list} FROM {staging_table};")
+            row_count = cur.rowcount
+        conn.commit()
+        with conn.cursor() as cur:
+            cur.execute(f"ANALYZE {local_table};")
+            cur.execute(f"DROP TABLE {staging_table};")
+        conn.commit()
+    logger.info(f"Loaded {row_count} rows into {local_table}")
 
-def update_schema(config: DatabaseConfig) -> Optional[int]:
-    """Update schema for a specific database configuration. Returns the new version if updated."""
+def snapshot_foreign_tables(config: DatabaseConfig) -> None:
+    """Reload the local copies of every configured table of a source database."""
+    version = load_schema_versions()[config.name]["version"]
+    if version is None:
+        raise ValueError(f"No schema version recorded for {config.name}")
+    remote_schema = f'chain_data_{version}'
+    partitions = get_chain_partitions(config, remote_schema)
+    for table in config.tables_to_import + config.tables_to_create:
+        snapshot_table(config, remote_schema, table, partitions)
+
+def update_schema(config: DatabaseConfig, probed_versions: Dict[str, Optional[int]]) -> Optional[int]:
+    """Update schema for a specific database configuration. Returns the new version if updated.
+
+    probed_versions only holds the configs that were due for a schema check.
+    """
     try:
-        # Check if we should proceed based on last check time
-        if not should_check_schema(config.name):
+        apply_fdw_profile(config, DB_PARAMS)
+        if SNAPSHOT_MODE:
+            move_foreign_tables_aside(config)
+
+        if config.name not in probed_versions:
             return None
 
         # Load existing versions
         current_versions = load_schema_versions()
         current_version = current_versions[config.name]["version"]
-        
-        # Get new version based on config type
-        new_version = (
-            get_indexer_version_with_most_data(config.db_params) if config.name == 'indexer'
-            else get_maci_latest_schema_version(config.db_params)
-        )
+        new_version = probed_versions[config.name]
         
         if new_version is None:
-            raise ValueError(f"Could not determine schema version for {config.name}")
+            if current_version is None:
+                raise ValueError(f"Could not determine schema version for {config.name}")
+            # Every probe failed or timed out, or there were no recent donations. Keep the
+            # current version and leave last_checked alone, so the next run probes again
+            logger.warning(f"Could not determine schema version for {config.name}, keeping version {current_version}")
+            return None
         
         # Update last checked time regardless of whether version changed
         current_versions[config.name]["last_checked"] = datetime.now().isoformat()
@@ -360,23 +581,28 @@ def update_schema(config: DatabaseConfig) -> Optional[int]:
         schema_name = f'chain_data_{new_version}'
         
         # Perform the update
-        drop_foreign_tables(config.tables_to_drop, config.schema, DB_PARAMS)
+        drop_foreign_tables(config.tables_to_drop, config.foreign_schema, DB_PARAMS)
+        if SNAPSHOT_MODE:
+            # Local copies are recreated from the new foreign tables by the snapshot step
+            for table in config.tables_to_import + config.tables_to_create:
+                execute_command(f'DROP TABLE IF EXISTS {config.schema}.{table} CASCADE;', DB_PARAMS)
         import_foreign_schema(
             schema_name,
             config.tables_to_import,
             DB_PARAMS,
             config.server,
-            config.schema
+            config.foreign_schema
         )
         
         for table in config.tables_to_create:
             create_table_from_definition(
                 table,
                 schema_name,
-                config.schema,
+                config.foreign_schema,
                 config.server,
                 DB_PARAMS
             )
+        analyze_foreign_tables(config, DB_PARAMS)
         
         # Update version and last checked time
         current_versions[config.name]["version"] = new_version
@@ -393,14 +619,22 @@ def main():
     """Main execution function."""
     try:
         updates = []
-        
+
+        # Probe both databases at once; the schema updates themselves run one after the other
+        due_configs = [config for config in (MACI_CONFIG, INDEXER_CONFIG) if should_check_schema(config.name)]
+        probed_versions = {}
+        if due_configs:
+            with ThreadPoolExecutor(max_workers=len(due_configs)) as executor:
+                probes = {config.name: executor.submit(probe_schema_version, config) for config in due_configs}
+            probed_versions = {name: probe.result() for name, probe in probes.items()}
+
         # Update MACI schema
-        maci_version = update_schema(MACI_CONFIG)
+        maci_version = update_schema(MACI_CONFIG, probed_versions)
         if maci_version:
             updates.append(f"MACI to {maci_version}")
         
         # Update Indexer schema
-        indexer_version = update_schema(INDEXER_CONFIG)
+        indexer_version = update_schema(INDEXER_CONFIG, probed_versions)
         if indexer_version:
             updates.append(f"Indexer to {indexer_version}")
             
@@ -408,6 +642,11 @@ def main():
             logger.info(f"Successfully updated schemas: {', '.join(updates)}")
         else:
             logger.info("No schema updates were necessary")
+
+        if SNAPSHOT_MODE:
+            for config in (MACI_CONFIG, INDEXER_CONFIG):
+                snapshot_foreign_tables(config)
+            logger.info("Local snapshots of the foreign tables are up to date")
             
     except Exception as e:
         logger.error(f"Schema update failed: {e}")
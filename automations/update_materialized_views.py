@@ -1,12 +1,24 @@
 import os
+import argparse
+import io
+import json
+import re
 import psycopg2
 import logging
+import multiprocessing
+import threading
 import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
 from decimal import Decimal
+from itertools import chain
 from typing import Dict, Optional, List
 from dune_client.client import DuneClient
 import pandas as pd 
 import hashlib
+from watermarks import build_watermark_filter
 
 
 # Set up logging
@@ -33,23 +45,52 @@ DB_PARAMS = {
 if not all(DB_PARAMS.values()):
     raise ValueError("Missing database connection parameters. Please check your environment variables.")
 
+# Schema holding refresh bookkeeping and the persistent local copies used by incremental refreshes
+ETL_STATE_SCHEMA = 'etl_state'
+
+# New views are built in STAGING_SCHEMA under their final names. Promotion moves the live
+# views to RETIRED_SCHEMA and the staged ones into place with ALTER ... SET SCHEMA
+STAGING_SCHEMA = 'matview_staging'
+RETIRED_SCHEMA = 'matview_retired'
+
+# A staged view left by a failed run is reused only if its checkpoint is younger than this
+CHECKPOINT_MAX_AGE_HOURS = float(os.environ.get('MATVIEW_CHECKPOINT_MAX_AGE_HOURS', '6'))
+
+# Maximum number of views built concurrently, one database connection per worker
+MAX_PARALLEL_BUILDS = int(os.environ.get('MATVIEW_MAX_WORKERS', '4'))
+
+# Indexes are built concurrently, each on its own connection with INDEX_MAINTENANCE_WORK_MEM.
+# The limit holds across all views being indexed at once, so index builds reserve at most
+# MAX_PARALLEL_INDEX_BUILDS * INDEX_MAINTENANCE_WORK_MEM (1.5GB by default)
+MAX_PARALLEL_INDEX_BUILDS = int(os.environ.get('MATVIEW_MAX_INDEX_WORKERS', '3'))
+INDEX_MAINTENANCE_WORK_MEM = os.environ.get('MATVIEW_INDEX_MAINTENANCE_WORK_MEM', '512MB')
+
 # Define materialized view configurations
 BASE_MATVIEWS = {
     'applications': {
         'index_columns': ['id', 'chain_id', 'round_id'],
         'order_by': 'id DESC, chain_id DESC, round_id DESC',
-        'amount_column': None
+        'amount_column': None,
+        'incremental': {
+            'watermark_column': 'GREATEST(created_at_block, status_updated_at_block)',
+            # Donation totals on an application change without a new block, so rounds
+            # that received donations since the last run are pulled again as well
+            'touched_by': {'relation': 'donations', 'watermark_column': 'block_number'}
+        }
     },
     'rounds': {
         'index_columns': ['id', 'chain_id'],
         'order_by': 'id DESC, chain_id DESC',
         'amount_column': 'total_amount_donated_in_usd + CASE WHEN matching_distribution IS NOT NULL THEN match_amount_in_usd ELSE 0 END'
     },
-     'donations': {
-         'index_columns': ['id'],
-         'order_by': 'id DESC',
-         'amount_column': 'amount_in_usd'
-     },
+    'donations': {
+        'index_columns': ['id'],
+        'order_by': 'id DESC',
+        'amount_column': 'amount_in_usd',
+        'incremental': {
+            'watermark_column': 'block_number'
+        }
+    },
     'applications_payouts': {
         'index_columns': ['id'],
         'order_by': 'id DESC',
@@ -72,25 +113,154 @@ DEPENDENT_MATVIEWS = {
     'indexer_matching': {
         'query_file': 'automations/queries/indexer_matching.sql',
         'amount_column': 'match_amount_in_usd',
-        'schema': 'public'  
+        'schema': 'public'
     },
     'all_donations': {
         'query_file': 'automations/queries/all_donations.sql',
         'amount_column': 'amount_in_usd',
-        'schema': 'public'
+        'schema': 'public',
+        'static_id_cache': 'static_donations',
+        'indexes': [
+            ['donor_address'],
+            ['recipient_address'],
+            ['chain_id', 'round_id'],
+            ['"timestamp"']
+        ]
     },
     'all_matching': {
         'query_file': 'automations/queries/all_matching.sql',
         'amount_column': 'match_amount_in_usd',
+        'schema': 'public',
+        'static_id_cache': 'static_matching'
+    },
+    'round_totals': {
+        'query_file': 'automations/queries/round_totals.sql',
+        'amount_column': '"Total USD"',
+        'schema': 'public',
+        'indexes': [
+            ['"Chain ID"', '"Round ID"']
+        ]
+    },
+    # Intermediate stages of the leaderboard, computed once per refresh and shared by its streams
+    'leaderboard_round_dim': {
+        'query_file': 'automations/queries/leaderboard_round_dim.sql',
+        'amount_column': None,
+        'schema': 'public',
+        'index_columns': ['chain_id', 'round_id']
+    },
+    'leaderboard_donation_rollup': {
+        'query_file': 'automations/queries/leaderboard_donation_rollup.sql',
+        'amount_column': 'amount_in_usd',
+        'schema': 'public'
+    },
+    'leaderboard_matching_distribution': {
+        'query_file': 'automations/queries/leaderboard_matching_distribution.sql',
+        'amount_column': 'amount_in_usd',
         'schema': 'public'
     },
     'allo_gmv_leaderboard_events': {
         'query_file': 'automations/queries/allo_gmv_with_ens.sql',
         'amount_column': 'gmv',
-        'schema': 'experimental_views'
+        'schema': 'experimental_views',
+        'indexes': [
+            ['address'],
+            ['role']
+        ]
+    }
+}
+
+# Historic halves of all_donations and all_matching, stored with their ids in
+# etl_state.<relation>_ids and rebuilt only when the static relation's fingerprint changes
+STATIC_ID_CACHES = {
+    'static_donations': {
+        'query_file': 'automations/queries/static_donations_ids.sql',
+        'id_column': 'donation_id'
+    },
+    'static_matching': {
+        'query_file': 'automations/queries/static_matching_ids.sql',
+        'id_column': 'matching_id'
     }
 }
 
+# Hourly and daily rollups of a promoted view, stored next to it as <view>_hourly and
+# <view>_daily. Each refresh re-aggregates only the buckets at or after the view's last
+# watermark minus ROLLUP_LOOKBACK_HOURS, which also catches rows indexed late
+TIME_ROLLUPS = {
+    'all_donations': {
+        'timestamp_column': 'd."timestamp"',
+        'from': """public.all_donations d
+        LEFT JOIN (
+            SELECT DISTINCT ON (chain_id, LOWER(round_id)) chain_id, LOWER(round_id) AS round_id, program
+            FROM program_round_labels
+            ORDER BY chain_id, LOWER(round_id), program
+        ) p ON p.chain_id = d.chain_id AND p.round_id = LOWER(d.round_id)""",
+        'dimensions': ['d.chain_id', 'd.round_id', 'p.program', 'd.source'],
+        'measures': [
+            'COUNT(*) AS donation_count',
+            'SUM(d.amount_in_usd) AS amount_in_usd',
+            'COUNT(DISTINCT d.donor_address) AS unique_donors'
+        ]
+    },
+    'allo_gmv_leaderboard_events': {
+        'timestamp_column': 'e.tx_timestamp',
+        'from': 'experimental_views.allo_gmv_leaderboard_events e',
+        'dimensions': ['e.blockchain', 'e.round_id', 'e.data_source', 'e.role'],
+        'measures': [
+            'COUNT(*) AS event_count',
+            'SUM(e.gmv) AS gmv',
+            'COUNT(DISTINCT e.address) AS unique_addresses'
+        ]
+    }
+}
+ROLLUP_GRANULARITIES = ['hour', 'day']
+ROLLUP_LOOKBACK_HOURS = float(os.environ.get('MATVIEW_ROLLUP_LOOKBACK_HOURS', '24'))
+FULL_ROLLUP_START = "'-infinity'::timestamptz"
+
+# Cheap queries whose result changes whenever a source relation's data does. Base views
+# read indexer.<view> (static_indexer_chain_data_75 never changes); dependent views read
+# the managed views their SQL file reads plus the other relations it reads, parsed from the same
+# file. Relations not listed here are fingerprinted by row count.
+SOURCE_FINGERPRINTS = {
+    'indexer.applications': """
+        SELECT COUNT(*), MAX(GREATEST(created_at_block, status_updated_at_block)), SUM(total_donations_count)
+        FROM indexer.applications WHERE chain_id != 11155111""",
+    'indexer.rounds': """
+        SELECT COUNT(*), MAX(updated_at_block), SUM(total_donations_count), COUNT(matching_distribution)
+        FROM indexer.rounds WHERE chain_id != 11155111""",
+    'indexer.donations': """
+        SELECT COUNT(*), MAX(block_number)
+        FROM indexer.donations WHERE chain_id != 11155111""",
+    'indexer.applications_payouts': """
+        SELECT COUNT(*), MAX(timestamp)
+        FROM indexer.applications_payouts WHERE chain_id != 11155111""",
+    'indexer.round_roles': """
+        SELECT COUNT(*), MAX(created_at_block)
+        FROM indexer.round_roles WHERE chain_id != 11155111""",
+    'maci.rounds': """
+        SELECT COUNT(*), MAX(updated_at_block)
+        FROM maci.rounds WHERE chain_id != 11155111""",
+    'maci.contributions': """
+        SELECT COUNT(*), MAX(timestamp)
+        FROM maci.contributions WHERE chain_id != 11155111""",
+    'maci.round_roles': """
+        SELECT COUNT(*), MAX(created_at_block)
+        FROM maci.round_roles WHERE chain_id != 11155111""",
+    # Re-uploaded from Google Sheets daily, small enough to hash in full
+    'program_round_labels': """
+        SELECT COUNT(*), md5(string_agg(t::text, ',' ORDER BY t::text))
+        FROM program_round_labels t"""
+}
+
+# etl_state tables that dependent views read, mapped to the relations they are computed from.
+# The tables are brought up to date only after the view's fingerprint is taken, so the
+# fingerprint has to look at what they are computed from. Tables computed from a managed
+# view map to nothing, since that view is already a dependency
+DERIVED_TABLE_SOURCES = {
+    f"{ETL_STATE_SCHEMA}.maci_round_stats": ['maci.contributions'],
+    f"{ETL_STATE_SCHEMA}.matching_distribution_items": [],
+    **{f"{ETL_STATE_SCHEMA}.{relation}_ids": [relation] for relation in STATIC_ID_CACHES}
+}
+
 def get_connection():
     """Establish database connection with proper settings."""
     try:
@@ -105,6 +275,32 @@ def get_connection():
         logger.error(f"Failed to connect to the database: {e}")
         raise
 
+# Worker threads each keep one connection, so the pool is bounded by MAX_PARALLEL_BUILDS
+_worker_state = threading.local()
+_worker_connections = []
+_worker_connections_lock = threading.Lock()
+
+def get_worker_connection():
+    """Return the connection owned by the current worker thread, opening it on first use."""
+    connection = getattr(_worker_state, 'connection', None)
+    if connection is None or connection.closed:
+        connection = get_connection()
+        _worker_state.connection = connection
+        with _worker_connections_lock:
+            _worker_connections.append(connection)
+    return connection
+
+def close_worker_connections() -> None:
+    """Close every connection opened by the build workers."""
+    with _worker_connections_lock:
+        for connection in _worker_connections:
+            if not connection.closed:
+                connection.close()
+        _worker_connections.clear()
+
+# Shared by the index builds of every view, see MAX_PARALLEL_INDEX_BUILDS
+_index_build_slots = threading.BoundedSemaphore(MAX_PARALLEL_INDEX_BUILDS)
+
 def execute_command(connection, command: str, params: tuple = None) -> None:
     """Execute a database command with proper error handling."""
     logger.info(f"Executing command: {command[:100]}...")
@@ -145,64 +341,963 @@ def get_matview_total(connection, matview: str, config: dict, schema: str = 'pub
         return None
 
 def cleanup_leftover_views(connection) -> None:
-    """Clean up any leftover _new views and tables from previous failed runs."""
-    logger.info("Cleaning up any leftover _new views and tables...")
-    
+    """Clean up leftover staged and retired views from previous failed runs.
+
+    Staged views with a checkpoint younger than CHECKPOINT_MAX_AGE_HOURS are kept, so the
+    next run can reuse them if their inputs haven't changed.
+    """
+    logger.info("Cleaning up any leftover staged and retired views...")
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT matview FROM {ETL_STATE_SCHEMA}.build_checkpoints
+            WHERE built_at > now() - %s * interval '1 hour'
+            """,
+            (CHECKPOINT_MAX_AGE_HOURS,)
+        )
+        resumable = {row[0] for row in cursor.fetchall()}
+    connection.commit()
+
     cleanup_commands = []
-    
-    # Clean up base views
-    for matview in BASE_MATVIEWS.keys():
-        cleanup_commands.append(f"DROP MATERIALIZED VIEW IF EXISTS public.{matview}_new CASCADE;")
-    
-    # Clean up dependent views
-    for matview, config in DEPENDENT_MATVIEWS.items():
-        schema = config.get('schema', 'public')
-        cleanup_commands.append(f"DROP MATERIALIZED VIEW IF EXISTS {schema}.{matview}_new CASCADE;")
-    
+    for matview in list(BASE_MATVIEWS) + list(DEPENDENT_MATVIEWS):
+        cleanup_commands.append(f"DROP MATERIALIZED VIEW IF EXISTS {RETIRED_SCHEMA}.{matview} CASCADE;")
+        if matview not in resumable:
+            cleanup_commands.append(f"DROP MATERIALIZED VIEW IF EXISTS {STAGING_SCHEMA}.{matview} CASCADE;")
+
+    if resumable:
+        logger.info(f"Keeping checkpointed views for reuse: {', '.join(sorted(resumable))}")
     execute_command(connection, "\n".join(cleanup_commands))
 
+def ensure_etl_state(connection) -> None:
+    """Create the bookkeeping schema and tables used across refresh runs."""
+    execute_command(connection, f"""
+    CREATE SCHEMA IF NOT EXISTS {ETL_STATE_SCHEMA};
+    CREATE TABLE IF NOT EXISTS {ETL_STATE_SCHEMA}.watermarks (
+        relation text NOT NULL,
+        source text NOT NULL,
+        chain_id integer NOT NULL,
+        watermark numeric NOT NULL,
+        updated_at timestamptz NOT NULL DEFAULT now(),
+        PRIMARY KEY (relation, source, chain_id)
+    );
+    CREATE TABLE IF NOT EXISTS {ETL_STATE_SCHEMA}.incremental_tables (
+        relation text PRIMARY KEY,
+        schema_version integer,
+        full_refresh_at timestamptz NOT NULL DEFAULT now()
+    );
+    CREATE TABLE IF NOT EXISTS {ETL_STATE_SCHEMA}.etl_runs (
+        run_id text NOT NULL,
+        step text NOT NULL,
+        relation text NOT NULL DEFAULT '',
+        status text NOT NULL,
+        started_at timestamptz NOT NULL,
+        duration_seconds double precision NOT NULL,
+        row_count bigint,
+        total_bytes bigint,
+        plan jsonb,
+        PRIMARY KEY (run_id, step, relation)
+    );
+    CREATE SCHEMA IF NOT EXISTS {STAGING_SCHEMA};
+    CREATE SCHEMA IF NOT EXISTS {RETIRED_SCHEMA};
+    CREATE TABLE IF NOT EXISTS {ETL_STATE_SCHEMA}.build_checkpoints (
+        matview text PRIMARY KEY,
+        fingerprint text NOT NULL,
+        run_id text NOT NULL,
+        built_at timestamptz NOT NULL DEFAULT now()
+    );
+    CREATE TABLE IF NOT EXISTS {ETL_STATE_SCHEMA}.static_id_caches (
+        relation text PRIMARY KEY,
+        fingerprint text NOT NULL,
+        built_at timestamptz NOT NULL DEFAULT now()
+    );
+    CREATE TABLE IF NOT EXISTS {ETL_STATE_SCHEMA}.view_fingerprints (
+        matview text PRIMARY KEY,
+        fingerprint text NOT NULL,
+        recorded_at timestamptz NOT NULL DEFAULT now()
+    );
+    """)
+
+def ensure_static_segments(connection) -> None:
+    """Create the frozen, deduplicated copy of static_indexer_chain_data_75 for each base view.
+
+    The static schema never changes, so each segment is built once, keyed by the view's
+    index columns. Drop etl_state.static_<view> to have it rebuilt on the next run.
+    """
+    for matview, config in BASE_MATVIEWS.items():
+        if config.get('refresh_type') == 'dune':
+            continue
+        segment = f"{ETL_STATE_SCHEMA}.static_{matview}"
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (segment,))
+            exists = cursor.fetchone()[0]
+        connection.commit()
+        if exists:
+            continue
+
+        index_columns = ', '.join(config['index_columns'])
+        logger.info(f"Creating frozen static segment {segment}")
+        execute_command(connection, f"""
+        BEGIN;
+        CREATE TABLE {segment} AS
+        SELECT DISTINCT ON ({index_columns}) *
+        FROM static_indexer_chain_data_75.{matview}
+        WHERE chain_id != 11155111
+        ORDER BY {index_columns};
+        CREATE UNIQUE INDEX static_{matview}_key ON {segment} ({index_columns});
+        ANALYZE {segment};
+        COMMIT;
+        """)
+
+def new_run_id() -> str:
+    """Identify a refresh run, reusing the GitHub Actions run id when there is one."""
+    github_run_id = os.environ.get('GITHUB_RUN_ID')
+    if github_run_id:
+        return f"{github_run_id}-{os.environ.get('GITHUB_RUN_ATTEMPT', '1')}"
+    return uuid.uuid4().hex
+
+def collect_relation_stats(connection, relation: str, explain: bool = False, exact_count: bool = True) -> dict:
+    """Row count and on-disk size of a relation, plus its query plan when explain is set.
+
+    Without exact_count, the row count is the planner's estimate from pg_class, which
+    CREATE INDEX keeps current, instead of another full scan.
+    """
+    stats = {}
+    with connection.cursor() as cursor:
+        if exact_count:
+            cursor.execute(f"SELECT COUNT(*), pg_total_relation_size('{relation}') FROM {relation}")
+        else:
+            cursor.execute(
+                "SELECT NULLIF(reltuples, -1)::bigint, pg_total_relation_size(oid) FROM pg_class WHERE oid = %s::regclass",
+                (relation,)
+            )
+        stats['row_count'], stats['total_bytes'] = cursor.fetchone()
+        if explain:
+            # Runs the view's query a second time, so only done on request
+            cursor.execute("SELECT pg_get_viewdef(%s::regclass)", (relation,))
+            definition = cursor.fetchone()[0].rstrip().rstrip(';')
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {definition}")
+            stats['plan'] = cursor.fetchone()[0]
+    connection.commit()
+    return stats
+
+def record_step(connection, run: dict, step: str, relation: Optional[str], status: str,
+                started_at: datetime, duration: float, stats: dict) -> None:
+    """Write one profiled step to etl_runs."""
+    plan = stats.get('plan')
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {ETL_STATE_SCHEMA}.etl_runs
+                    (run_id, step, relation, status, started_at, duration_seconds, row_count, total_bytes, plan)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (run_id, step, relation) DO UPDATE
+                SET status = EXCLUDED.status, started_at = EXCLUDED.started_at,
+                    duration_seconds = EXCLUDED.duration_seconds, row_count = EXCLUDED.row_count,
+                    total_bytes = EXCLUDED.total_bytes, plan = EXCLUDED.plan
+                """,
+                (run['run_id'], step, relation or '', status, started_at, duration,
+                 stats.get('row_count'), stats.get('total_bytes'),
+                 json.dumps(plan) if plan is not None else None)
+            )
+        connection.commit()
+    except psycopg2.Error as e:
+        logger.warning(f"Could not record {step} step for {relation}: {e}")
+        connection.rollback()
+
+@contextmanager
+def profile_step(connection, run: dict, step: str, relation: Optional[str] = None):
+    """Time a refresh step and record it in etl_runs.
+
+    Yields a dict the step can fill with row_count, total_bytes and plan, and can set
+    'status' in, e.g. to mark a view as skipped.
+    """
+    stats = {}
+    started_at = datetime.now(timezone.utc)
+    start_time = time.time()
+    status = 'ok'
+    try:
+        yield stats
+    except Exception:
+        status = 'failed'
+        raise
+    finally:
+        record_step(connection, run, step, relation, stats.pop('status', status),
+                    started_at, time.time() - start_time, stats)
+
+def report_latest_run(connection, history_runs: int = 10) -> pd.DataFrame:
+    """Compare each step of the latest run with its median over the preceding runs."""
+    query = f"""
+    WITH runs AS (
+        SELECT run_id, MIN(started_at) AS started_at,
+               ROW_NUMBER() OVER (ORDER BY MIN(started_at) DESC) AS recency
+        FROM {ETL_STATE_SCHEMA}.etl_runs
+        GROUP BY run_id
+    ),
+    latest AS (
+        SELECT e.* FROM {ETL_STATE_SCHEMA}.etl_runs e
+        JOIN runs r ON r.run_id = e.run_id AND r.recency = 1
+    ),
+    history AS (
+        SELECT
+            e.step,
+            e.relation,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY e.duration_seconds) AS median_seconds,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY e.row_count) AS median_rows,
+            percentile_cont(0.5) WITHIN GROUP (ORDER BY e.total_bytes) AS median_bytes,
+            COUNT(*) AS runs
+        FROM {ETL_STATE_SCHEMA}.etl_runs e
+        JOIN runs r ON r.run_id = e.run_id AND r.recency BETWEEN 2 AND %s
+        WHERE e.status = 'ok'
+        GROUP BY e.step, e.relation
+    )
+    SELECT
+        l.run_id,
+        l.step,
+        l.relation,
+        l.status,
+        ROUND(l.duration_seconds::numeric, 1) AS seconds,
+        ROUND(h.median_seconds::numeric, 1) AS median_seconds,
+        ROUND((l.duration_seconds / NULLIF(h.median_seconds, 0))::numeric, 2) AS time_ratio,
+        l.row_count,
+        h.median_rows,
+        pg_size_pretty(l.total_bytes) AS size,
+        pg_size_pretty(h.median_bytes::bigint) AS median_size,
+        h.runs AS history_runs
+    FROM latest l
+    LEFT JOIN history h ON h.step = l.step AND h.relation = l.relation
+    ORDER BY l.started_at
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(query, (history_runs + 1,))
+        col_names = [desc[0] for desc in cursor.description]
+        return pd.DataFrame(cursor.fetchall(), columns=col_names)
+
+def get_foreign_read_queries(connection) -> Dict[str, str]:
+    """The queries base view builds send to indexer.* foreign tables."""
+    queries = {}
+    for matview, config in BASE_MATVIEWS.items():
+        if config.get('refresh_type') == 'dune':
+            continue
+        filters = ['chain_id != 11155111']
+        if config.get('incremental'):
+            watermark_column = config['incremental']['watermark_column']
+            filters.append(build_watermark_filter(watermark_column, get_watermarks(connection, matview, 'self')))
+        queries[matview] = f"SELECT * FROM indexer.{matview} WHERE {' AND '.join(filters)}"
+    return queries
+
+def find_remote_sql(plan: dict) -> List[str]:
+    """Remote SQL of every foreign scan in an EXPLAIN (VERBOSE, FORMAT JSON) plan."""
+    remote_sql = [plan['Remote SQL']] if 'Remote SQL' in plan else []
+    for child in plan.get('Plans', []):
+        remote_sql.extend(find_remote_sql(child))
+    return remote_sql
+
+def check_foreign_pushdown(connection) -> None:
+    """Fail if the chain filter of a base view read is evaluated locally instead of remotely.
+
+    A filter that isn't shipped means postgres_fdw pulls every row across and discards
+    the testnet ones here.
+    """
+    failures = []
+    for matview, query in get_foreign_read_queries(connection).items():
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (VERBOSE, FORMAT JSON) {query}")
+            plan = cursor.fetchone()[0][0]['Plan']
+        connection.commit()
+        remote_sql = find_remote_sql(plan)
+        if not remote_sql:
+            logger.info(f"indexer.{matview} is read locally, nothing to push down")
+        elif all('chain_id <> 11155111' in sql for sql in remote_sql):
+            logger.info(f"Chain filter of indexer.{matview} is pushed down")
+        else:
+            failures.append(matview)
+            logger.error(f"Chain filter of indexer.{matview} is not pushed down. Remote SQL: {remote_sql}")
+    if failures:
+        raise ValueError(f"Filters are not pushed down to the indexer for: {', '.join(failures)}")
+
+def get_indexer_schema_version() -> Optional[int]:
+    """Read the indexer schema version written by update_foreign_schema.py."""
+    try:
+        with open('schema_versions.json', 'r') as f:
+            return json.load(f)['indexer']['version']
+    except (FileNotFoundError, KeyError) as e:
+        logger.warning(f"Could not read indexer schema version: {e}")
+        return None
+
+def get_watermarks(connection, relation: str, source: str) -> Dict[int, Decimal]:
+    """Return the stored high-water mark per chain for a relation."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT chain_id, watermark FROM {ETL_STATE_SCHEMA}.watermarks WHERE relation = %s AND source = %s",
+            (relation, source)
+        )
+        return dict(cursor.fetchall())
+
+def get_local_table_state(connection, matview: str, schema_version: Optional[int], table: Optional[str] = None) -> str:
+    """Return 'missing', 'stale' (built for another indexer schema version) or 'current'."""
+    table = table or f"{ETL_STATE_SCHEMA}.{matview}_incremental"
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+        table_exists = cursor.fetchone()[0]
+        cursor.execute(
+            f"SELECT schema_version FROM {ETL_STATE_SCHEMA}.incremental_tables WHERE relation = %s",
+            (matview,)
+        )
+        row = cursor.fetchone()
+    connection.commit()
+
+    if not table_exists or row is None:
+        logger.info(f"No local copy of {matview} yet, doing a full refresh")
+        return 'missing'
+    if schema_version is None or row[0] != schema_version:
+        logger.info(f"Indexer schema changed ({row[0]} -> {schema_version}), doing a full refresh of {matview}")
+        return 'stale'
+    return 'current'
+
+def needs_full_refresh(connection, matview: str, schema_version: Optional[int], table: Optional[str] = None) -> bool:
+    """Decide whether the local copy of an incremental view must be rebuilt from scratch."""
+    return get_local_table_state(connection, matview, schema_version, table) != 'current'
+
+def refresh_incremental_table(connection, matview: str, config: dict, full_refresh: bool = False) -> None:
+    """Bring the persistent local copy of indexer.{matview} up to date.
+
+    Only rows at or past the stored per-chain watermark are pulled across the FDW and
+    merged on the view's index columns. A full rebuild happens on the first run, when the
+    indexer schema version changes, or when requested.
+    """
+    incremental = config['incremental']
+    table = f"{ETL_STATE_SCHEMA}.{matview}_incremental"
+    watermark_column = incremental['watermark_column']
+    touched_by = incremental.get('touched_by')
+    index_columns = config['index_columns']
+    schema_version = get_indexer_schema_version()
+
+    table_state = get_local_table_state(connection, matview, schema_version)
+    if full_refresh or table_state != 'current':
+        commands = [
+            "BEGIN;",
+            f"DELETE FROM {ETL_STATE_SCHEMA}.watermarks WHERE relation = '{matview}';"
+        ]
+        if touched_by:
+            # Record the touching relation's position before the copy so nothing is missed
+            commands.append(f"""
+            INSERT INTO {ETL_STATE_SCHEMA}.watermarks (relation, source, chain_id, watermark)
+            SELECT '{matview}', '{touched_by['relation']}', chain_id, MAX({touched_by['watermark_column']})
+            FROM indexer.{touched_by['relation']}
+            WHERE chain_id != 11155111 AND {touched_by['watermark_column']} IS NOT NULL
+            GROUP BY chain_id;""")
+        if table_state == 'current':
+            # The live view reads this table, so it is reloaded in place rather than dropped
+            commands.extend([
+                f"TRUNCATE {table};",
+                f"INSERT INTO {table} SELECT * FROM indexer.{matview} WHERE chain_id != 11155111;"
+            ])
+        else:
+            # A new indexer schema can change the columns. update_foreign_schema.py already
+            # drops the views on the old foreign tables, and the CASCADE does the same here
+            commands.extend([
+                f"DROP TABLE IF EXISTS {table} CASCADE;",
+                f"CREATE TABLE {table} AS SELECT * FROM indexer.{matview} WHERE chain_id != 11155111;",
+                f"CREATE UNIQUE INDEX {matview}_incremental_key ON {table} ({', '.join(index_columns)});"
+            ])
+        commands.extend([
+            f"""
+            INSERT INTO {ETL_STATE_SCHEMA}.watermarks (relation, source, chain_id, watermark)
+            SELECT '{matview}', 'self', chain_id, MAX({watermark_column})
+            FROM {table}
+            WHERE {watermark_column} IS NOT NULL
+            GROUP BY chain_id;""",
+            f"""
+            INSERT INTO {ETL_STATE_SCHEMA}.incremental_tables (relation, schema_version, full_refresh_at)
+            VALUES ('{matview}', {schema_version if schema_version is not None else 'NULL'}, now())
+            ON CONFLICT (relation) DO UPDATE
+            SET schema_version = EXCLUDED.schema_version, full_refresh_at = EXCLUDED.full_refresh_at;""",
+            "COMMIT;"
+        ])
+        logger.info(f"Full refresh of {table}")
+        execute_command(connection, "\n".join(commands))
+        return
+
+    delta_filter = build_watermark_filter(watermark_column, get_watermarks(connection, matview, 'self'))
+    touched_commands = []
+
+    if touched_by:
+        touched_watermark = touched_by['watermark_column']
+        touched_filter = build_watermark_filter(
+            touched_watermark, get_watermarks(connection, matview, touched_by['relation'])
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+            SELECT chain_id, round_id, MAX({touched_watermark})
+            FROM indexer.{touched_by['relation']}
+            WHERE chain_id != 11155111 AND {touched_filter}
+            GROUP BY chain_id, round_id
+            """)
+            touched_rounds = cursor.fetchall()
+
+            rounds_by_chain = {}
+            touched_watermarks = {}
+            for chain_id, round_id, watermark in touched_rounds:
+                rounds_by_chain.setdefault(chain_id, []).append(round_id)
+                if watermark is not None:
+                    touched_watermarks[chain_id] = max(watermark, touched_watermarks.get(chain_id, watermark))
+            touched_clauses = [
+                cursor.mogrify("(chain_id = %s AND round_id IN %s)", (chain_id, tuple(round_ids))).decode()
+                for chain_id, round_ids in rounds_by_chain.items()
+            ]
+        connection.commit()
+
+        if touched_clauses:
+            logger.info(f"{len(touched_rounds)} rounds have new {touched_by['relation']} since the last {matview} refresh")
+            delta_filter = f"({delta_filter} OR {' OR '.join(touched_clauses)})"
+
+        for chain_id, watermark in touched_watermarks.items():
+            touched_commands.append(f"""
+            INSERT INTO {ETL_STATE_SCHEMA}.watermarks (relation, source, chain_id, watermark)
+            VALUES ('{matview}', '{touched_by['relation']}', {int(chain_id)}, {Decimal(watermark)})
+            ON CONFLICT (relation, source, chain_id) DO UPDATE
+            SET watermark = GREATEST({ETL_STATE_SCHEMA}.watermarks.watermark, EXCLUDED.watermark), updated_at = now();""")
+
+    key_match = ' AND '.join(f"t.{column} = d.{column}" for column in index_columns)
+    commands = [
+        "BEGIN;",
+        f"""
+        CREATE TEMP TABLE {matview}_delta ON COMMIT DROP AS
+        SELECT * FROM indexer.{matview}
+        WHERE chain_id != 11155111 AND {delta_filter};""",
+        f"DELETE FROM {table} t USING {matview}_delta d WHERE {key_match};",
+        f"INSERT INTO {table} SELECT * FROM {matview}_delta;",
+        f"""
+        INSERT INTO {ETL_STATE_SCHEMA}.watermarks (relation, source, chain_id, watermark)
+        SELECT '{matview}', 'self', chain_id, MAX({watermark_column})
+        FROM {matview}_delta
+        WHERE {watermark_column} IS NOT NULL
+        GROUP BY chain_id
+        ON CONFLICT (relation, source, chain_id) DO UPDATE
+        SET watermark = GREATEST({ETL_STATE_SCHEMA}.watermarks.watermark, EXCLUDED.watermark), updated_at = now();""",
+        *touched_commands,
+        "COMMIT;"
+    ]
+
+    logger.info(f"Incremental refresh of {table}")
+    execute_command(connection, "\n".join(commands))
+
+MATCHING_DISTRIBUTION_ITEMS_SQL = """
+    SELECT
+        r.chain_id,
+        r.id AS round_id,
+        md.position,
+        md.value->>'applicationId' AS application_id,
+        md.value->>'projectId' AS project_id,
+        md.value->>'projectName' AS project_name,
+        md.value->>'projectPayoutAddress' AS project_payout_address,
+        md.value->>'contributionsCount' AS contributions_count,
+        md.value->>'matchAmountInToken' AS match_amount_in_token,
+        md.value->>'matchPoolPercentage' AS match_pool_percentage,
+        md.value->>'originalMatchAmountInToken' AS original_match_amount_in_token,
+        TO_TIMESTAMP(r.matching_distribution->>'blockTimestamp', 'YYYY-MM-DD"T"HH24:MI:SS.MSZ') AS timestamp,
+        CASE
+            WHEN r.id = '0xa1d52f9b5339792651861329a046dd912761e9a9' THEN (CAST(md.value->>'matchPoolPercentage' AS NUMERIC) * r.match_amount_in_usd)/1000000000000
+            ELSE (CAST(md.value->>'matchPoolPercentage' AS NUMERIC) * r.match_amount_in_usd)
+        END AS match_amount_in_usd
+    FROM {rounds} r
+    {round_filter}
+    CROSS JOIN LATERAL
+        jsonb_array_elements(r.matching_distribution->'matchingDistribution') WITH ORDINALITY AS md(value, position)
+    WHERE r.chain_id != 11155111
+"""
+
+def refresh_matching_distribution_items(connection, rounds: str, full_refresh: bool = False, rounds_changed: bool = True) -> None:
+    """Keep etl_state.matching_distribution_items in step with the given copy of rounds.
+
+    Only rounds whose matching_distribution or match amount hash changed are expanded
+    again; finalized rounds are left alone. A full rebuild happens on the first run, when
+    the indexer schema version changes, or when requested.
+    """
+    items = f"{ETL_STATE_SCHEMA}.matching_distribution_items"
+    hashes = f"{ETL_STATE_SCHEMA}.matching_distribution_rounds"
+    hash_sql = f"""
+        SELECT chain_id, id AS round_id,
+            md5(matching_distribution::text || COALESCE(match_amount_in_usd::text, '')) AS distribution_hash
+        FROM {rounds}
+        WHERE chain_id != 11155111 AND matching_distribution IS NOT NULL"""
+    schema_version = get_indexer_schema_version()
+
+    if full_refresh or needs_full_refresh(connection, 'matching_distribution_items', schema_version, items):
+        all_items_sql = MATCHING_DISTRIBUTION_ITEMS_SQL.format(rounds=rounds, round_filter='')
+        # The live views read the table, so it is reloaded in place rather than dropped
+        commands = [
+            "BEGIN;",
+            f"CREATE TABLE IF NOT EXISTS {items} AS {all_items_sql} WITH NO DATA;",
+            f"CREATE INDEX IF NOT EXISTS matching_distribution_items_round ON {items} (chain_id, round_id);",
+            f"CREATE TABLE IF NOT EXISTS {hashes} AS {hash_sql} WITH NO DATA;",
+            f"CREATE UNIQUE INDEX IF NOT EXISTS matching_distribution_rounds_key ON {hashes} (chain_id, round_id);",
+            f"TRUNCATE {items}, {hashes};",
+            f"INSERT INTO {items} {all_items_sql};",
+            f"INSERT INTO {hashes} {hash_sql};",
+            f"""
+            INSERT INTO {ETL_STATE_SCHEMA}.incremental_tables (relation, schema_version, full_refresh_at)
+            VALUES ('matching_distribution_items', {schema_version if schema_version is not None else 'NULL'}, now())
+            ON CONFLICT (relation) DO UPDATE
+            SET schema_version = EXCLUDED.schema_version, full_refresh_at = EXCLUDED.full_refresh_at;""",
+            "COMMIT;"
+        ]
+        logger.info(f"Full refresh of {items}")
+        execute_command(connection, "\n".join(commands))
+        return
+
+    if not rounds_changed:
+        return
+
+    # Rounds whose hash changed, plus rounds whose distribution disappeared
+    changed_items_sql = MATCHING_DISTRIBUTION_ITEMS_SQL.format(
+        rounds=rounds,
+        round_filter="JOIN matching_distribution_changed c ON c.chain_id = r.chain_id AND c.round_id = r.id"
+    )
+    commands = [
+        "BEGIN;",
+        f"CREATE TEMP TABLE matching_distribution_hashes ON COMMIT DROP AS {hash_sql};",
+        f"""
+        CREATE TEMP TABLE matching_distribution_changed ON COMMIT DROP AS
+        SELECT chain_id, round_id FROM (
+            SELECT chain_id, round_id, distribution_hash FROM matching_distribution_hashes
+            EXCEPT
+            SELECT chain_id, round_id, distribution_hash FROM {hashes}
+        ) changed
+        UNION
+        SELECT s.chain_id, s.round_id FROM {hashes} s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM matching_distribution_hashes h
+            WHERE h.chain_id = s.chain_id AND h.round_id = s.round_id
+        );""",
+        f"""
+        DELETE FROM {items} i USING matching_distribution_changed c
+        WHERE i.chain_id = c.chain_id AND i.round_id = c.round_id;""",
+        f"""
+        INSERT INTO {items}
+        {changed_items_sql};""",
+        f"""
+        DELETE FROM {hashes} s USING matching_distribution_changed c
+        WHERE s.chain_id = c.chain_id AND s.round_id = c.round_id;""",
+        f"""
+        INSERT INTO {hashes}
+        SELECT h.* FROM matching_distribution_hashes h
+        JOIN matching_distribution_changed c ON c.chain_id = h.chain_id AND c.round_id = h.round_id;""",
+        "COMMIT;"
+    ]
+    logger.info(f"Incremental refresh of {items}")
+    execute_command(connection, "\n".join(commands))
+
+def ensure_static_id_cache(connection, relation: str, run: dict) -> None:
+    """Store a static relation's rows with their ids, unless they are already stored for its current contents."""
+    cache = STATIC_ID_CACHES[relation]
+    table = f"{ETL_STATE_SCHEMA}.{relation}_ids"
+    fingerprint = get_source_fingerprint(connection, relation, run)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT fingerprint FROM {ETL_STATE_SCHEMA}.static_id_caches WHERE relation = %s",
+            (relation,)
+        )
+        row = cursor.fetchone()
+    connection.commit()
+    if row is not None and row[0] == fingerprint:
+        return
+
+    with open(cache['query_file'], 'r') as file:
+        query = file.read()
+
+    # The live view reads the table, so it is reloaded in place rather than dropped. all_matching
+    # relies on the ids being unique, so a duplicate id fails the load and keeps the old rows
+    logger.info(f"Computing ids for {relation} into {table}")
+    execute_command(connection, f"""
+    BEGIN;
+    CREATE TABLE IF NOT EXISTS {table} AS {query} WITH NO DATA;
+    DROP INDEX IF EXISTS {ETL_STATE_SCHEMA}.{relation}_ids_id;
+    TRUNCATE {table};
+    CREATE UNIQUE INDEX IF NOT EXISTS {relation}_ids_key ON {table} ({cache['id_column']});
+    INSERT INTO {table} {query};
+    ANALYZE {table};
+    INSERT INTO {ETL_STATE_SCHEMA}.static_id_caches (relation, fingerprint, built_at)
+    VALUES ('{relation}', '{fingerprint}', now())
+    ON CONFLICT (relation) DO UPDATE
+    SET fingerprint = EXCLUDED.fingerprint, built_at = EXCLUDED.built_at;
+    COMMIT;
+    """)
+
+MACI_ROUND_STATS_SQL = """
+    SELECT
+        round_id,
+        chain_id,
+        SUM(voice_credit_balance) / 100000 * 3000 as USD,
+        COUNT(DISTINCT contributor_address) as unique_donors,
+        COUNT(DISTINCT transaction_hash) as transactions,
+        MAX(timestamp) as latest_contribution,
+        COUNT(*) as contribution_count
+    FROM
+        maci."contributions"
+    WHERE {round_filter}
+    GROUP BY
+        round_id, chain_id
+"""
+
+def build_maci_activity_filter(connection, marks: Dict[tuple, datetime]) -> str:
+    """Build a WHERE clause selecting MACI contributions past their round's high-water mark.
+
+    Rounds without a mark yet are caught by taking contributions at or past the highest
+    mark of their chain, since a chain's contributions are indexed in block order. Chains
+    without any mark are pulled in full.
+    """
+    if not marks:
+        return "TRUE"
+    rounds_by_chain = {}
+    for (round_id, chain_id), latest in marks.items():
+        rounds_by_chain.setdefault(chain_id, []).append((round_id, latest))
+    clauses = []
+    with connection.cursor() as cursor:
+        # Constants are inlined so postgres_fdw pushes the filter down to the MACI database
+        for chain_id, rounds in sorted(rounds_by_chain.items()):
+            clauses.extend(
+                cursor.mogrify("(chain_id = %s AND round_id = %s AND timestamp > %s)", (chain_id, round_id, latest)).decode()
+                for round_id, latest in rounds
+            )
+            round_ids = tuple(round_id for round_id, _ in rounds)
+            chain_mark = max(latest for _, latest in rounds)
+            clauses.append(cursor.mogrify(
+                "(chain_id = %s AND round_id NOT IN %s AND timestamp >= %s)", (chain_id, round_ids, chain_mark)
+            ).decode())
+        clauses.append(cursor.mogrify("chain_id NOT IN %s", (tuple(sorted(rounds_by_chain)),)).decode())
+    return "(" + " OR ".join(clauses) + ")"
+
+def refresh_maci_round_stats(connection, full_refresh: bool = False) -> None:
+    """Bring etl_state.maci_round_stats up to date for round_totals.
+
+    The latest contribution stored for each round is its high-water mark. Only
+    contributions past the marks are looked up across the FDW, and only the rounds they
+    belong to are aggregated again.
+    """
+    table = f"{ETL_STATE_SCHEMA}.maci_round_stats"
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+        table_exists = cursor.fetchone()[0]
+    connection.commit()
+
+    if full_refresh or not table_exists:
+        all_stats_sql = MACI_ROUND_STATS_SQL.format(round_filter='TRUE')
+        # round_totals reads the table, so it is reloaded in place rather than dropped
+        logger.info(f"Full refresh of {table}")
+        execute_command(connection, f"""
+        BEGIN;
+        CREATE TABLE IF NOT EXISTS {table} AS {all_stats_sql} WITH NO DATA;
+        CREATE UNIQUE INDEX IF NOT EXISTS maci_round_stats_key ON {table} (chain_id, round_id);
+        TRUNCATE {table};
+        INSERT INTO {table} {all_stats_sql};
+        COMMIT;
+        """)
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT round_id, chain_id, latest_contribution FROM {table} WHERE latest_contribution IS NOT NULL")
+        marks = {(round_id, chain_id): latest for round_id, chain_id, latest in cursor.fetchall()}
+    connection.commit()
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+        SELECT DISTINCT round_id, chain_id
+        FROM maci."contributions"
+        WHERE {build_maci_activity_filter(connection, marks)}
+        """)
+        changed = cursor.fetchall()
+    connection.commit()
+
+    if not changed:
+        logger.info(f"No new MACI contributions since the last refresh of {table}")
+        return
+    logger.info(f"{len(changed)} MACI rounds have new contributions")
+
+    rounds_by_chain = {}
+    for round_id, chain_id in changed:
+        rounds_by_chain.setdefault(chain_id, []).append(round_id)
+    with connection.cursor() as cursor:
+        # Constants are inlined so postgres_fdw pushes the filter down to the MACI database
+        round_filter = " OR ".join(
+            cursor.mogrify("(chain_id = %s AND round_id IN %s)", (chain_id, tuple(round_ids))).decode()
+            for chain_id, round_ids in rounds_by_chain.items()
+        )
+
+    execute_command(connection, "\n".join([
+        "BEGIN;",
+        f"DELETE FROM {table} WHERE {round_filter};",
+        f"INSERT INTO {table} {MACI_ROUND_STATS_SQL.format(round_filter=round_filter)};",
+        "COMMIT;"
+    ]))
+
+def prepare_view_inputs(connection, matview: str, config: dict, run: dict) -> None:
+    """Bring the etl_state tables a dependent view reads up to date before it is built."""
+    if config.get('static_id_cache'):
+        ensure_static_id_cache(connection, config['static_id_cache'], run)
+    if matview == 'round_totals':
+        refresh_maci_round_stats(connection, run['full_refresh'])
+
+def refresh_derived_tables(connection, matview: str, relation: str, run: dict, changed: bool) -> None:
+    """Keep the etl_state tables derived from a base view in step with the copy its dependents will read."""
+    if matview == 'rounds':
+        refresh_matching_distribution_items(connection, relation, run['full_refresh'], changed)
+
+def get_source_fingerprint(connection, source: str, run: dict) -> str:
+    """Fingerprint one source relation, computing it at most once per run."""
+    if source not in run['source_fingerprints']:
+        query = SOURCE_FINGERPRINTS.get(source, f"SELECT COUNT(*) FROM {source}")
+        with connection.cursor() as cursor:
+            cursor.execute(query)
+            result = cursor.fetchone()
+        connection.commit()
+        run['source_fingerprints'][source] = hashlib.md5(repr(result).encode()).hexdigest()
+    return run['source_fingerprints'][source]
+
+def compute_view_fingerprint(connection, matview: str, run: dict) -> str:
+    """Combine the fingerprints of everything a view reads into one value."""
+    if matview in BASE_MATVIEWS:
+        config = BASE_MATVIEWS[matview]
+        sources = config.get('sources', [f"indexer.{matview}"])
+        parts = []
+    else:
+        config = DEPENDENT_MATVIEWS[matview]
+        with open(config['query_file'], 'rb') as file:
+            query = file.read()
+        sources = get_external_sources(query.decode())
+        parts = [f"query={hashlib.md5(query).hexdigest()}"]
+        parts.extend(f"{dep}={run['fingerprints'][dep]}" for dep in run['graph'][matview])
+
+    parts.extend(f"{source}={get_source_fingerprint(connection, source, run)}" for source in sources)
+    return hashlib.md5("|".join(parts).encode()).hexdigest()
+
+def get_dune_fingerprint(query_result) -> str:
+    """Identify a Dune result by the execution that produced it."""
+    return f"{query_result.execution_id}:{query_result.times.execution_ended_at}"
+
+def can_skip_view(connection, matview: str, schema: str, fingerprint: str, run: dict) -> bool:
+    """A view can be skipped when its inputs are unchanged since it was last swapped in."""
+    if run['full_refresh']:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (f"{schema}.{matview}",))
+        exists = cursor.fetchone()[0]
+        cursor.execute(
+            f"SELECT fingerprint FROM {ETL_STATE_SCHEMA}.view_fingerprints WHERE matview = %s",
+            (matview,)
+        )
+        row = cursor.fetchone()
+    connection.commit()
+    return exists and row is not None and row[0] == fingerprint
+
+def record_build_checkpoint(connection, matview: str, run: dict) -> None:
+    """Mark a staged view and its indexes as complete, so a failed run can resume from it."""
+    execute_command(connection, f"""
+    INSERT INTO {ETL_STATE_SCHEMA}.build_checkpoints (matview, fingerprint, run_id, built_at)
+    VALUES ('{matview}', '{run['fingerprints'][matview]}', '{run['run_id']}', now())
+    ON CONFLICT (matview) DO UPDATE
+    SET fingerprint = EXCLUDED.fingerprint, run_id = EXCLUDED.run_id, built_at = EXCLUDED.built_at;
+    """)
+
+def can_reuse_checkpoint(connection, matview: str, fingerprint: str, run: dict) -> bool:
+    """A staged view left by an earlier run can be reused if it is complete, fresh and built from the same inputs."""
+    if run['full_refresh']:
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (f"{STAGING_SCHEMA}.{matview}",))
+        exists = cursor.fetchone()[0]
+        cursor.execute(
+            f"""
+            SELECT fingerprint FROM {ETL_STATE_SCHEMA}.build_checkpoints
+            WHERE matview = %s AND built_at > now() - %s * interval '1 hour'
+            """,
+            (matview, CHECKPOINT_MAX_AGE_HOURS)
+        )
+        row = cursor.fetchone()
+    connection.commit()
+    return exists and row is not None and row[0] == fingerprint
+
+def record_view_fingerprints(connection, run: dict) -> None:
+    """Store the fingerprints of the views swapped in by this run."""
+    commands = [
+        f"""
+        INSERT INTO {ETL_STATE_SCHEMA}.view_fingerprints (matview, fingerprint, recorded_at)
+        VALUES ('{matview}', '{run['fingerprints'][matview]}', now())
+        ON CONFLICT (matview) DO UPDATE
+        SET fingerprint = EXCLUDED.fingerprint, recorded_at = EXCLUDED.recorded_at;"""
+        for matview in run['built']
+    ]
+    # The promoted views are no longer staged, so their checkpoints are spent
+    swapped = ', '.join(f"'{matview}'" for matview in run['built'])
+    commands.append(f"DELETE FROM {ETL_STATE_SCHEMA}.build_checkpoints WHERE matview IN ({swapped});")
+    execute_command(connection, "\n".join(commands))
+
+def get_latest_dune_result(dune_api_key: str):
+    """Fetch the latest results of the leaderboard query from Dune."""
+    logger.info("Initializing Dune client")
+    dune = DuneClient(dune_api_key)
+    logger.info("Fetching latest results from query 4118421")
+    query_result = dune.get_latest_result(4118421)
+    logger.info("Successfully retrieved query results")
+    return query_result
+
+# Dune (Trino) column types mapped to Postgres. Decimals and doubles load as numeric, which
+# is what the old VALUES literal produced and what the leaderboard's UNION ALL expects for gmv.
+DUNE_TYPE_MAP = {
+    'varchar': 'text',
+    'boolean': 'boolean',
+    'tinyint': 'smallint',
+    'smallint': 'smallint',
+    'integer': 'integer',
+    'bigint': 'bigint',
+    'double': 'numeric',
+    'real': 'numeric',
+    'decimal': 'numeric',
+    'uint256': 'numeric',
+    'int256': 'numeric',
+    'date': 'date',
+    'timestamp': 'timestamp',
+    'timestamp with time zone': 'timestamptz',
+}
+
+INTEGER_TYPES = {'smallint', 'integer', 'bigint'}
+
+# Rows sent per COPY batch, keeps the CSV buffer small for large results
+COPY_CHUNK_ROWS = 50000
+
+def get_dune_column_types(metadata) -> Dict[str, str]:
+    """Map each column of a Dune result to a Postgres type, falling back to text for unknown types."""
+    dune_types = getattr(metadata, 'column_types', None)
+    # Loading every column as text would only fail later, when the leaderboard's UNION ALL builds
+    if not dune_types or len(dune_types) != len(metadata.column_names):
+        raise ValueError(f"Dune result metadata has no column types for columns {metadata.column_names}")
+    column_types = {}
+    for name, dune_type in zip(metadata.column_names, dune_types):
+        # Strip precision and parameters, e.g. 'timestamp(3) with time zone' or 'decimal(38,0)'
+        base_type = re.sub(r'\(.*?\)', '', dune_type.lower()).strip()
+        column_types[name] = DUNE_TYPE_MAP.get(base_type, 'text')
+    return column_types
+
+def copy_dataframe_to_table(connection, df: pd.DataFrame, table: str, column_types: Dict[str, str]) -> None:
+    """(Re)create an unlogged table and load the frame into it with COPY FROM STDIN."""
+    # Integer columns with missing values arrive as floats, and COPY rejects '5.0' for an integer
+    integer_columns = [col for col in df.columns if column_types.get(col) in INTEGER_TYPES]
+    if integer_columns:
+        df = df.copy()
+        for col in integer_columns:
+            df[col] = pd.to_numeric(df[col]).astype('Int64')
+    columns = ', '.join(f'"{col}"' for col in df.columns)
+    column_definitions = ', '.join(f'"{col}" {column_types.get(col, "text")}' for col in df.columns)
+    execute_command(connection, f"""
+    DROP TABLE IF EXISTS {table};
+    CREATE UNLOGGED TABLE {table} ({column_definitions});
+    """)
+
+    logger.info(f"Copying {len(df)} rows into {table}")
+    try:
+        with connection.cursor() as cursor:
+            for start in range(0, len(df), COPY_CHUNK_ROWS):
+                buffer = io.StringIO()
+                df.iloc[start:start + COPY_CHUNK_ROWS].to_csv(buffer, index=False, header=False, na_rep='\\N')
+                buffer.seek(0)
+                cursor.copy_expert(
+                    f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                    buffer
+                )
+        connection.commit()
+    except psycopg2.Error as e:
+        logger.error(f"Database error while copying into {table}: {e}")
+        connection.rollback()
+        raise
+
+# Columns concatenated, in order, into the key hashed for event_signature
+EVENT_SIGNATURE_COLUMNS = ['tx_timestamp', 'tx_hash', 'address', 'gmv', 'role', 'row_number']
+HASH_CHUNK_ROWS = 100000
+# Frames at least this large are hashed on a process pool. The keys are too short for hashlib
+# to release the GIL, so threads wouldn't help. Workers are spawned rather than forked, since
+# the pool is started from a build thread while other threads hold connections and locks
+HASH_PROCESS_POOL_MIN_ROWS = int(os.environ.get('DUNE_HASH_PROCESS_POOL_MIN_ROWS', '500000'))
+
+def sha256_hexdigests(keys: List[str]) -> List[str]:
+    """Hash a batch of keys."""
+    return [hashlib.sha256(key.encode()).hexdigest() for key in keys]
+
+def compute_event_signatures(df: pd.DataFrame) -> pd.Series:
+    """Hash EVENT_SIGNATURE_COLUMNS for every row.
+
+    Each value is formatted with str(), exactly like the f-string previously applied per
+    row, so the signatures are byte-identical to the ones already in the database.
+    """
+    columns = [df[col].map(str).tolist() for col in EVENT_SIGNATURE_COLUMNS]
+    keys = [''.join(parts) for parts in zip(*columns)]
+    chunks = [keys[start:start + HASH_CHUNK_ROWS] for start in range(0, len(keys), HASH_CHUNK_ROWS)]
+
+    if len(keys) >= HASH_PROCESS_POOL_MIN_ROWS and len(chunks) > 1:
+        logger.info(f"Hashing {len(keys)} event signatures on a process pool")
+        with ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn')) as executor:
+            digests = list(chain.from_iterable(executor.map(sha256_hexdigests, chunks)))
+    else:
+        digests = list(chain.from_iterable(map(sha256_hexdigests, chunks)))
+    return pd.Series(digests, index=df.index)
+
+DUNE_DATA_TABLE_PREFIX = 'dune_leaderboard_data_'
+
+def drop_unused_dune_data_tables(connection) -> None:
+    """Drop Dune data tables that no view (live, staged or retired) is built from any more."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.oid::regclass::text
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = %s AND c.relkind = 'r' AND c.relname LIKE %s
+            AND NOT EXISTS (
+                SELECT 1 FROM pg_depend d
+                WHERE d.classid = 'pg_rewrite'::regclass AND d.refobjid = c.oid
+            )
+            """,
+            (ETL_STATE_SCHEMA, DUNE_DATA_TABLE_PREFIX.replace('_', '\\_') + '%')
+        )
+        unused = [row[0] for row in cursor.fetchall()]
+    connection.commit()
+    if unused:
+        execute_command(connection, "\n".join(f"DROP TABLE IF EXISTS {table};" for table in unused))
+
 # Add new function for Dune refresh
-def refresh_dune_base_view(connection, dune_api_key: str) -> None:
+def refresh_dune_base_view(connection, dune_api_key: str, query_result=None, run_id: Optional[str] = None) -> None:
     """Refresh the Dune-based view using the API."""
     try:
-        # Initialize Dune client and get query results
-        logger.info("Initializing Dune client")
-        dune = DuneClient(dune_api_key)
-        logger.info("Fetching latest results from query 4118421")
-        query_result = dune.get_latest_result(4118421)
-        logger.info("Successfully retrieved query results")
+        if query_result is None:
+            query_result = get_latest_dune_result(dune_api_key)
         query_result_df = pd.DataFrame(query_result.result.rows)
         # Sort dataframe and add row number column
         query_result_df = query_result_df.sort_values(by=['tx_timestamp','role', 'address', 'gmv'])
         query_result_df['row_number'] = range(1, len(query_result_df) + 1)
         
         # Create hash_id by concatenating and hashing relevant columns
-        query_result_df['event_signature'] = query_result_df.apply(
-            lambda row: hashlib.sha256(
-                f"{row['tx_timestamp']}{row['tx_hash']}{row['address']}{row['gmv']}{row['role']}{row['row_number']}".encode()
-            ).hexdigest(),
-            axis=1
-        )
+        query_result_df['event_signature'] = compute_event_signatures(query_result_df)
 
         # validation
         if len(query_result_df) == 0:
             raise ValueError("Empty result set from Dune")
 
-        # Convert dataframe to SQL values
-        values = []
-        for _, row in query_result_df.iterrows():
-            value_list = [
-                f"'{str(v)}'" if isinstance(v, (str, pd.Timestamp)) else str(v) if v is not None else 'NULL'
-                for v in row.values
-            ]
-            values.append(f"({', '.join(value_list)})")
+        # Stream the frame into a typed table and build the view from it. The view depends
+        # on the table, so each run loads its own and unused ones are dropped later
+        drop_unused_dune_data_tables(connection)
+        column_types = get_dune_column_types(query_result.result.metadata)
+        column_types.update({'row_number': 'bigint', 'event_signature': 'text'})
+        data_suffix = re.sub(r'\W', '_', run_id or uuid.uuid4().hex).lower()
+        data_table = f"{ETL_STATE_SCHEMA}.{DUNE_DATA_TABLE_PREFIX}{data_suffix}"
+        copy_dataframe_to_table(connection, query_result_df, data_table, column_types)
 
         create_command = f"""
-        DROP MATERIALIZED VIEW IF EXISTS public.allov2_distribution_events_for_leaderboard_new CASCADE;
-        CREATE MATERIALIZED VIEW public.allov2_distribution_events_for_leaderboard_new AS
-        SELECT * FROM (
-            VALUES {','.join(values)}
-        ) AS t({', '.join(f'"{col}"' for col in query_result_df.columns)});
+        BEGIN;
+        DROP MATERIALIZED VIEW IF EXISTS {STAGING_SCHEMA}.allov2_distribution_events_for_leaderboard CASCADE;
+        CREATE MATERIALIZED VIEW {STAGING_SCHEMA}.allov2_distribution_events_for_leaderboard AS
+        SELECT * FROM {data_table};
+        COMMIT;
         """
 
         execute_command(connection, create_command)
@@ -213,114 +1308,101 @@ def refresh_dune_base_view(connection, dune_api_key: str) -> None:
         raise
 
 
-def create_base_matview(connection, matview: str, config: dict) -> None:
-    """Create a new base materialized view."""
-    index_columns = ', '.join(config['index_columns'])
+def create_base_matview(connection, matview: str, config: dict, full_refresh: bool = False) -> None:
+    """Create a staged base materialized view from live indexer rows plus the frozen static segment."""
+    # Incremental views read live rows from their local copy instead of the foreign table
+    live_source = f"indexer.{matview}"
+    if config.get('incremental'):
+        refresh_incremental_table(connection, matview, config, full_refresh)
+        live_source = f"{ETL_STATE_SCHEMA}.{matview}_incremental"
 
-    # Base SQL structure with subqueries wrapped in parentheses
+    # Live rows win over static ones with the same key, so static rows only fill the gaps
+    key_match = ' AND '.join(f"l.{column} = s.{column}" for column in config['index_columns'])
     base_sql = """
-    DROP MATERIALIZED VIEW IF EXISTS public.{matview}_new CASCADE;
-    CREATE MATERIALIZED VIEW public.{matview}_new AS
-    WITH ranked_data AS (
-        SELECT 
-            *,
-            ROW_NUMBER() OVER (
-                PARTITION BY {index_columns}
-                ORDER BY 
-                    CASE 
-                        WHEN source = 'indexer' THEN 1 
-                        WHEN source = 'static' THEN 2 
-                    END
-            ) as row_num
-        FROM (
-            (SELECT *, 'indexer' as source 
-            FROM indexer.{matview} 
-            WHERE chain_id != 11155111)
-            UNION ALL
-            (SELECT *, 'static' as source 
-            FROM static_indexer_chain_data_75.{matview} 
-            WHERE chain_id != 11155111)
-        ) combined_data
+    DROP MATERIALIZED VIEW IF EXISTS {staging_schema}.{matview} CASCADE;
+    CREATE MATERIALIZED VIEW {staging_schema}.{matview} AS
+    WITH live_data AS MATERIALIZED (
+        SELECT *, 'indexer' as source
+        FROM {live_source}
+        WHERE chain_id != 11155111
     )
-    SELECT * FROM ranked_data WHERE row_num = 1;
+    SELECT *, 1::bigint as row_num FROM live_data
+    UNION ALL
+    SELECT s.*, 'static' as source, 1::bigint as row_num
+    FROM {static_segment} s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM live_data l WHERE {key_match}
+    );
     """
     
     create_command = base_sql.format(
         matview=matview,
-        index_columns=index_columns
+        staging_schema=STAGING_SCHEMA,
+        live_source=live_source,
+        static_segment=f"{ETL_STATE_SCHEMA}.static_{matview}",
+        key_match=key_match
     )
     
     execute_command(connection, create_command)
 
 def create_dependent_matview(connection, matview: str, config: dict) -> None:
-    query_file = config['query_file']
-    schema = config.get('schema', 'public')
-    
-    with open(query_file, 'r') as file:
-        query = file.read()
+    """Create a staged dependent view from its unmodified SQL file.
 
-    if matview == 'allo_gmv_leaderboard_events':
-        # Find the first CTE
-        with_start = query.find('WITH')
-        first_select = query.find('SELECT', with_start)
-        
-        # Insert our table mappings right after the WITH
-        base_tables_cte = """
-            donations AS (SELECT * FROM public.donations_new),
-            rounds AS (SELECT * FROM public.rounds_new),
-            applications AS (SELECT * FROM public.applications_new),
-            applications_payouts AS (SELECT * FROM public.applications_payouts_new),
-            allov2_distribution_events_for_leaderboard AS (SELECT * FROM public.allov2_distribution_events_for_leaderboard_new),
-            chain_mapping AS (
-        """
-        
-        # Stitch it together
-        new_query = (
-            query[:with_start + 4] +  # "WITH"
-            "\n" + base_tables_cte + 
-            query[first_select:]  # start from the SELECT of first CTE
-        )
-        
-        logger.info(f"Original query start:\n{query[:500]}...")
-        logger.info(f"Modified query start:\n{new_query[:500]}...")
-        
-        query = new_query
-    else:
-        # For other views, use the existing string replacement logic
-        for view in list(BASE_MATVIEWS.keys()) + list(DEPENDENT_MATVIEWS.keys()):
-            from_pattern = f"FROM {view} "
-            if from_pattern in query:
-                query = query.replace(from_pattern, f"FROM {view}_new ")
-            join_pattern = f"JOIN {view} "
-            if join_pattern in query:
-                query = query.replace(join_pattern, f"JOIN {view}_new ")
+    The staging schema comes first on the search_path, so the query reads the staged copy
+    of every view rebuilt this run and the live copy of everything else.
+    """
+    with open(config['query_file'], 'r') as file:
+        query = file.read()
 
     create_command = f"""
-    DROP MATERIALIZED VIEW IF EXISTS {schema}.{matview}_new CASCADE;
-    
-    CREATE MATERIALIZED VIEW {schema}.{matview}_new AS
+    SET LOCAL search_path TO {STAGING_SCHEMA}, public;
+    DROP MATERIALIZED VIEW IF EXISTS {STAGING_SCHEMA}.{matview} CASCADE;
+
+    CREATE MATERIALIZED VIEW {STAGING_SCHEMA}.{matview} AS
     {query}
     """
-    
-    logger.info(f"Creating {matview}_new with schema {schema}")
-    if matview == 'allo_gmv_leaderboard_events':
-        # Extra logging for our problematic view
-        logger.info(f"Final create command start:\n{create_command[:1000]}...")
-    
+
+    logger.info(f"Creating {STAGING_SCHEMA}.{matview} for schema {config.get('schema', 'public')}")
     execute_command(connection, create_command)
 
-def create_indexes(connection, matview: str, config: dict) -> None:
-    """Create indexes for a materialized view."""
+def get_index_statements(relation: str, config: dict) -> List[str]:
+    """The unique index on index_columns plus the secondary indexes declared in the config."""
+    # Index names are left to Postgres, so they can't clash with the live view's indexes
+    statements = []
     if 'index_columns' in config:
-        index_columns = ', '.join(config['index_columns'])
-        index_name = f"{matview}_idx"
-        
-        index_command = f"""
-        CREATE UNIQUE INDEX IF NOT EXISTS {index_name}
-        ON public.{matview} ({index_columns});
-        """
-        
-        execute_command(connection, index_command)
+        statements.append(f"CREATE UNIQUE INDEX ON {relation} ({', '.join(config['index_columns'])});")
+    for columns in config.get('indexes', []):
+        statements.append(f"CREATE INDEX ON {relation} ({', '.join(columns)});")
+    return statements
+
+def create_index(statement: str) -> None:
+    """Build a single index on a dedicated connection with a larger maintenance_work_mem.
+
+    Waits for one of the MAX_PARALLEL_INDEX_BUILDS slots shared by all views.
+    """
+    with _index_build_slots:
+        connection = get_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SET maintenance_work_mem = %s;", (INDEX_MAINTENANCE_WORK_MEM,))
+                logger.info(f"Executing command: {statement[:100]}...")
+                cursor.execute(statement)
+            connection.commit()
+        finally:
+            connection.close()
+
+def create_indexes(matview: str, config: dict, schema: str = 'public') -> None:
+    """Create all indexes for a materialized view, building them concurrently."""
+    statements = get_index_statements(f"{schema}.{matview}", config)
+    if not statements:
+        return
+
+    workers = min(MAX_PARALLEL_INDEX_BUILDS, len(statements))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{matview}_index") as executor:
+        futures = [executor.submit(create_index, statement) for statement in statements]
+        for future in futures:
+            # result() re-raises the index error, if any
+            future.result()
 
 def validate_refresh(connection, matview: str, config: dict, old_total: Optional[Decimal]) -> None:
     """Validate the refresh operation for a materialized view."""
@@ -366,120 +1448,460 @@ def check_view_exists(connection, schema: str, matview: str) -> bool:
         logger.error(f"Error checking view existence: {e}")
         return False
 
+SQL_COMMENT_PATTERN = re.compile(r"--[^\n]*|/\*.*?\*/", re.DOTALL)
+SQL_STRING_PATTERN = re.compile(r"'(?:[^']|'')*'")
+CTE_NAME_PATTERN = re.compile(
+    r'(?:\bWITH\s+(?:RECURSIVE\s+)?|,\s*)(\w+)\s+AS\s+(?:NOT\s+)?(?:MATERIALIZED\s+)?\(',
+    re.IGNORECASE
+)
+RELATION_PATTERN = re.compile(r'\b(?:FROM|JOIN)\s+(?!LATERAL\b)((?:"[^"]+"|\w+)(?:\.(?:"[^"]+"|\w+))?)', re.IGNORECASE)
 
-def refresh_materialized_views(connection) -> None:
-    """Refresh all materialized views while maintaining dependencies."""
-    try:
+def parse_query_relations(query: str) -> set:
+    """Return the relations a query reads in FROM and JOIN clauses, excluding its own CTEs."""
+    query = SQL_STRING_PATTERN.sub("''", SQL_COMMENT_PATTERN.sub(' ', query))
+    cte_names = {name.lower() for name in CTE_NAME_PATTERN.findall(query)}
+
+    relations = set()
+    for match in RELATION_PATTERN.finditer(query):
+        # Set-returning functions such as jsonb_array_elements(...) aren't relations
+        if query[match.end():].lstrip().startswith('('):
+            continue
+        name = match.group(1)
+        if '.' not in name:
+            name = name.strip('"')
+        if name.lower() not in cte_names:
+            relations.add(name)
+    return relations
+
+QUOTED_LOWERCASE_NAME_PATTERN = re.compile(r'"([a-z_][a-z0-9_]*)"')
+
+def get_external_sources(query: str) -> List[str]:
+    """Return the relations other than managed views that a dependent view's SQL reads.
+
+    Quotes are dropped from names that don't need them, so the names match SOURCE_FINGERPRINTS,
+    and etl_state tables are replaced by what they are computed from.
+    """
+    managed = set(BASE_MATVIEWS) | set(DEPENDENT_MATVIEWS)
+    sources = set()
+    for relation in parse_query_relations(query):
+        if relation in managed:
+            continue
+        relation = QUOTED_LOWERCASE_NAME_PATTERN.sub(r'\1', relation)
+        if relation.startswith(f"{ETL_STATE_SCHEMA}."):
+            if relation not in DERIVED_TABLE_SOURCES:
+                raise ValueError(f"Add {relation} to DERIVED_TABLE_SOURCES so views reading it are fingerprinted")
+            sources.update(DERIVED_TABLE_SOURCES[relation])
+        else:
+            sources.add(relation)
+    return sorted(sources)
+
+def build_dependency_graph() -> Dict[str, List[str]]:
+    """Map every view to the managed views it reads, parsed from the dependent views' SQL files.
+
+    Only unqualified references count, since those are the ones resolved through the staging schema.
+    """
+    graph = {matview: [] for matview in BASE_MATVIEWS}
+    managed = set(BASE_MATVIEWS) | set(DEPENDENT_MATVIEWS)
+    for matview, config in DEPENDENT_MATVIEWS.items():
+        with open(config['query_file'], 'r') as file:
+            relations = parse_query_relations(file.read())
+        graph[matview] = sorted(relation for relation in relations if relation in managed and relation != matview)
+        logger.info(f"{matview} reads views: {', '.join(graph[matview]) or 'none'}")
+    return graph
+
+def select_views(graph: Dict[str, List[str]], targets: List[str]) -> set:
+    """The targets plus every view upstream and downstream of them."""
+    unknown = [target for target in targets if target not in graph]
+    if unknown:
+        raise ValueError(f"Unknown views: {', '.join(unknown)}")
+
+    dependents = {matview: [] for matview in graph}
+    for matview, dependencies in graph.items():
+        for dep in dependencies:
+            dependents[dep].append(matview)
+
+    selected = set(targets)
+    for edges in (graph, dependents):
+        stack = list(targets)
+        while stack:
+            for related in edges[stack.pop()]:
+                if related not in selected:
+                    selected.add(related)
+                    stack.append(related)
+    return selected
+
+def is_out_of_scope(matview: str, run: dict) -> bool:
+    """With --only, views outside the selection are left alone unless a view they read was rebuilt."""
+    if run['only'] is None or matview in run['only']:
+        return False
+    # Promotion retires a rebuilt view, so everything reading it must be rebuilt as well
+    return not any(dep in run['built'] for dep in run['graph'][matview])
+
+def get_recorded_fingerprint(connection, matview: str) -> str:
+    """The fingerprint stored when the live view was last swapped in, or '' if there is none."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT fingerprint FROM {ETL_STATE_SCHEMA}.view_fingerprints WHERE matview = %s",
+            (matview,)
+        )
+        row = cursor.fetchone()
+    connection.commit()
+    return row[0] if row else ''
 
-        # Step 1: Store current totals for validation (base views only)
-        logger.info("Recording current totals...")
-        old_totals = {}
-        for matview, config in BASE_MATVIEWS.items():
-            old_totals[matview] = get_matview_total(connection, matview, config)
+def drop_staged_view(connection, matview: str) -> None:
+    """Drop a stale staged copy of a skipped view, so dependents read the live one."""
+    execute_command(connection, f"DROP MATERIALIZED VIEW IF EXISTS {STAGING_SCHEMA}.{matview} CASCADE;")
 
-        # Step 2: Create all new base views
-        logger.info("Creating new base materialized views...")
-        for matview, config in BASE_MATVIEWS.items():
-            logger.info(f"Creating {matview}_new...")
+def build_matview(matview: str, run: dict) -> bool:
+    """Build a single staged view and its indexes on the current worker's connection.
+
+    Returns False when the view was skipped because its inputs are unchanged.
+    """
+    connection = get_worker_connection()
+    start_time = time.time()
+    schema = get_matview_schema(matview)
+
+    with profile_step(connection, run, 'build', f"{schema}.{matview}") as stats:
+        if is_out_of_scope(matview, run):
+            logger.info(f"Skipping {matview}: not selected by --only")
+            # Views selected downstream read the live copy, so they fingerprint against it
+            run['fingerprints'][matview] = get_recorded_fingerprint(connection, matview)
+            drop_staged_view(connection, matview)
+            stats['status'] = 'skipped'
+            return False
+        if matview in BASE_MATVIEWS:
+            config = BASE_MATVIEWS[matview]
             if config.get('refresh_type') == 'dune':
-                # Get Dune API key from environment
                 dune_api_key = os.environ.get('DUNE_API_KEY')
-                if not dune_api_key:
-                    raise ValueError("DUNE_API_KEY environment variable is required")
-                refresh_dune_base_view(connection, dune_api_key)
+                query_result = get_latest_dune_result(dune_api_key)
+                run['fingerprints'][matview] = get_dune_fingerprint(query_result)
+                if can_skip_view(connection, matview, schema, run['fingerprints'][matview], run):
+                    logger.info(f"Skipping {matview}: Dune execution unchanged")
+                    drop_staged_view(connection, matview)
+                    stats['status'] = 'skipped'
+                    return False
+                if can_reuse_checkpoint(connection, matview, run['fingerprints'][matview], run):
+                    logger.info(f"Reusing staged {matview} from an earlier run")
+                    stats['status'] = 'reused'
+                    return True
+                logger.info(f"Creating staged {matview}...")
+                refresh_dune_base_view(connection, dune_api_key, query_result, run['run_id'])
             else:
-                create_base_matview(connection, matview, config)
-            create_indexes(connection, f"{matview}_new", config)
-
-        # Step 3: Create all new dependent views
-        logger.info("Creating new dependent materialized views...")
-        for matview, config in DEPENDENT_MATVIEWS.items():
-            logger.info(f"Creating {matview}_new...")
+                run['fingerprints'][matview] = compute_view_fingerprint(connection, matview, run)
+                if can_skip_view(connection, matview, schema, run['fingerprints'][matview], run):
+                    logger.info(f"Skipping {matview}: sources unchanged")
+                    drop_staged_view(connection, matview)
+                    refresh_derived_tables(connection, matview, f"public.{matview}", run, changed=False)
+                    stats['status'] = 'skipped'
+                    return False
+                if can_reuse_checkpoint(connection, matview, run['fingerprints'][matview], run):
+                    logger.info(f"Reusing staged {matview} from an earlier run")
+                    refresh_derived_tables(connection, matview, f"{STAGING_SCHEMA}.{matview}", run, changed=True)
+                    stats['status'] = 'reused'
+                    return True
+                logger.info(f"Creating staged {matview}...")
+                create_base_matview(connection, matview, config, run['full_refresh'])
+                refresh_derived_tables(connection, matview, f"{STAGING_SCHEMA}.{matview}", run, changed=True)
+        else:
+            config = DEPENDENT_MATVIEWS[matview]
+            run['fingerprints'][matview] = compute_view_fingerprint(connection, matview, run)
+            # Anything reading a rebuilt view must be rebuilt too, or promotion would retire it
+            dependencies_rebuilt = any(dep in run['built'] for dep in run['graph'][matview])
+            if not dependencies_rebuilt and can_skip_view(connection, matview, schema, run['fingerprints'][matview], run):
+                logger.info(f"Skipping {matview}: inputs unchanged")
+                drop_staged_view(connection, matview)
+                stats['status'] = 'skipped'
+                return False
+            # A staged view survives only if none of the views it reads were rebuilt (DROP ... CASCADE)
+            if can_reuse_checkpoint(connection, matview, run['fingerprints'][matview], run):
+                logger.info(f"Reusing staged {matview} from an earlier run")
+                stats['status'] = 'reused'
+                return True
+            logger.info(f"Creating staged {matview}...")
+            prepare_view_inputs(connection, matview, config, run)
             create_dependent_matview(connection, matview, config)
-            if 'index_columns' in config:
-                create_indexes(connection, f"{matview}_new", config)
-
-        # Step 4: Atomic swap of all views
-        logger.info("Performing atomic swap of all views...")
-        swap_commands = ["BEGIN;"]
-
-        # Add swap commands for all views
-        for matview, config in BASE_MATVIEWS.items():
-            schema = 'public'  # base views are always in public
-            swap_commands.extend([
-                f"DROP MATERIALIZED VIEW IF EXISTS {schema}.{matview}_old CASCADE;",
-                f"ALTER MATERIALIZED VIEW IF EXISTS {schema}.{matview} RENAME TO {matview}_old;",
-                f"ALTER MATERIALIZED VIEW {schema}.{matview}_new RENAME TO {matview};"
-            ])
+        stats.update(collect_relation_stats(connection, f"{STAGING_SCHEMA}.{matview}", run['explain']))
 
-        for matview, config in DEPENDENT_MATVIEWS.items():
-            schema = config.get('schema', 'public')
-            swap_commands.extend([
-                f"DROP MATERIALIZED VIEW IF EXISTS {schema}.{matview}_old CASCADE;",
-                f"ALTER MATERIALIZED VIEW IF EXISTS {schema}.{matview} RENAME TO {matview}_old;",
-                f"ALTER MATERIALIZED VIEW {schema}.{matview}_new RENAME TO {matview};"
-            ])
+    if 'index_columns' in config or config.get('indexes'):
+        with profile_step(connection, run, 'index', f"{schema}.{matview}") as stats:
+            create_indexes(matview, config, STAGING_SCHEMA)
+            stats.update(collect_relation_stats(connection, f"{STAGING_SCHEMA}.{matview}", exact_count=False))
 
-        swap_commands.append("COMMIT;")
+    record_build_checkpoint(connection, matview, run)
+    logger.info(f"Finished staged {matview} in {time.time() - start_time:.2f} seconds")
+    return True
 
+def build_matviews_in_parallel(graph: Dict[str, List[str]], run: dict, max_workers: int = MAX_PARALLEL_BUILDS) -> None:
+    """Build views as soon as their dependencies are done, up to max_workers at a time.
 
-        execute_command(connection, "\n".join(swap_commands))
+    Built views are added to run['built'] and unchanged ones to run['skipped'].
+    """
+    pending = dict(graph)
+    completed = set()
+    running = {}
 
-        logger.info("=== POST-SWAP HEALTH CHECK ===")
-        check_view_exists(connection, 'experimental_views', 'allo_gmv_leaderboard_events')
-
-        # Step 5: Validate
-        logger.info("Validating refreshed views...")
-        for matview, config in BASE_MATVIEWS.items():
-            validate_refresh(connection, matview, config, old_totals[matview])
-            
-        for matview, config in DEPENDENT_MATVIEWS.items():
-            schema = config.get('schema', 'public')
-            new_total = get_matview_total(connection, matview, config, schema)
-            logger.info(f"New dependent view {schema}.{matview} total: {new_total}")
-
-        logger.info("=== PRE-CLEANUP HEALTH CHECK ===")
-        check_view_exists(connection, 'experimental_views', 'allo_gmv_leaderboard_events')
-
-        # Step 6: Cleanup
-        logger.info("Cleaning up old views...")
-        cleanup_commands = []
-        for matview, config in BASE_MATVIEWS.items():
-            cmd = f"DROP MATERIALIZED VIEW IF EXISTS public.{matview}_old CASCADE;"
-            cleanup_commands.append(cmd)
-            logger.info(f"Adding cleanup command for base view: {cmd}")
-
-        for matview, config in DEPENDENT_MATVIEWS.items():
-            schema = config.get('schema', 'public')
-            cmd = f"DROP MATERIALIZED VIEW IF EXISTS {schema}.{matview}_old CASCADE;"
-            cleanup_commands.append(cmd)
-            logger.info(f"Adding cleanup command for dependent view: {cmd}")
-
-        # Before executing them all
-        logger.info("About to execute cleanup commands:")
-        for cmd in cleanup_commands:
-            logger.info(f"Will execute: {cmd}")
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='matview') as executor:
+        try:
+            while pending or running:
+                ready = [
+                    matview for matview, dependencies in pending.items()
+                    if all(dep in completed for dep in dependencies)
+                ]
+                for matview in ready:
+                    del pending[matview]
+                    running[executor.submit(build_matview, matview, run)] = matview
 
-        execute_command(connection, "\n".join(cleanup_commands))
-        
-        logger.info("=== POST-CLEANUP HEALTH CHECK ===")
-        check_view_exists(connection, 'experimental_views', 'allo_gmv_leaderboard_events')
+                if not running:
+                    raise ValueError(f"Circular dependency between views: {', '.join(pending)}")
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    matview = running.pop(future)
+                    # result() re-raises the build error, if any
+                    if future.result():
+                        run['built'].add(matview)
+                    else:
+                        run['skipped'].add(matview)
+                    completed.add(matview)
+        except Exception:
+            # Don't start anything new; builds already running finish on shutdown
+            for future in running:
+                future.cancel()
+            raise
+
+def get_matview_schema(matview: str) -> str:
+    """Base views always live in public; dependent views declare their schema."""
+    return DEPENDENT_MATVIEWS.get(matview, {}).get('schema', 'public')
+
+def get_rollup_tables(matview: str) -> List[str]:
+    schema = get_matview_schema(matview)
+    return [f"{schema}.{matview}_{'hourly' if granularity == 'hour' else 'daily'}" for granularity in ROLLUP_GRANULARITIES]
 
+def rollup_tables_exist(connection, matview: str) -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT bool_and(to_regclass(t) IS NOT NULL) FROM unnest(%s) AS t", (get_rollup_tables(matview),))
+        exist = cursor.fetchone()[0]
+    connection.commit()
+    return exist
+
+def build_rollup_query(config: dict, granularity: str, since: str) -> str:
+    """Aggregate a view into buckets of one granularity, starting at the bucket holding `since`."""
+    dimensions = ", ".join(config['dimensions'])
+    measures = ",\n        ".join(config['measures'])
+    return f"""
+    SELECT
+        date_trunc('{granularity}', {config['timestamp_column']}) AS bucket,
+        {dimensions},
+        {measures}
+    FROM {config['from']}
+    WHERE {config['timestamp_column']} >= date_trunc('{granularity}', {since})
+    GROUP BY 1, {dimensions}"""
+
+def refresh_time_rollup(connection, matview: str, config: dict, full_refresh: bool) -> None:
+    """Re-aggregate the rollup buckets of a view touched since its last watermark."""
+    watermarks = get_watermarks(connection, matview, 'rollup')
+    full_refresh = full_refresh or 0 not in watermarks or not rollup_tables_exist(connection, matview)
+
+    commands = ["BEGIN;", "SET LOCAL timezone TO 'UTC';"]
+    for granularity, table in zip(ROLLUP_GRANULARITIES, get_rollup_tables(matview)):
+        if full_refresh:
+            # Nothing in the database reads the rollups, so they can simply be recreated
+            commands.extend([
+                f"DROP TABLE IF EXISTS {table};",
+                f"CREATE TABLE {table} AS {build_rollup_query(config, granularity, FULL_ROLLUP_START)};",
+                f"CREATE INDEX ON {table} (bucket);"
+            ])
+        else:
+            since = f"to_timestamp({watermarks[0]}) - interval '{ROLLUP_LOOKBACK_HOURS} hours'"
+            commands.extend([
+                f"DELETE FROM {table} WHERE bucket >= date_trunc('{granularity}', {since});",
+                f"INSERT INTO {table} {build_rollup_query(config, granularity, since)};"
+            ])
+    commands.extend([
+        f"""
+        INSERT INTO {ETL_STATE_SCHEMA}.watermarks (relation, source, chain_id, watermark)
+        SELECT '{matview}', 'rollup', 0, COALESCE(EXTRACT(EPOCH FROM MAX({config['timestamp_column']})), 0)
+        FROM {config['from']}
+        ON CONFLICT (relation, source, chain_id) DO UPDATE
+        SET watermark = EXCLUDED.watermark, updated_at = now();""",
+        "COMMIT;"
+    ])
+
+    logger.info(f"{'Rebuilding' if full_refresh else 'Updating'} hourly and daily rollups of {matview}")
+    execute_command(connection, "\n".join(commands))
+    for table in get_rollup_tables(matview):
+        execute_command(connection, f"ANALYZE {table};")
+
+def refresh_time_rollups(connection, run: dict) -> None:
+    """Refresh the rollups of every view promoted in this run, and create any that are missing."""
+    for matview, config in TIME_ROLLUPS.items():
+        if matview not in run['built'] and not run['full_refresh'] and rollup_tables_exist(connection, matview):
+            continue
+        with profile_step(connection, run, 'rollup', matview):
+            refresh_time_rollup(connection, matview, config, run['full_refresh'])
+
+def refresh_materialized_views(connection, full_refresh: bool = False, explain: bool = False,
+                               only: Optional[List[str]] = None) -> None:
+    """Refresh all materialized views while maintaining dependencies."""
+    try:
+        ensure_etl_state(connection)
+        check_foreign_pushdown(connection)
+        cleanup_leftover_views(connection)
+        ensure_static_segments(connection)
+        graph = build_dependency_graph()
+        run = {
+            'run_id': new_run_id(),
+            'graph': graph,
+            'only': select_views(graph, only) if only else None,
+            'full_refresh': full_refresh,
+            'explain': explain,
+            'fingerprints': {},
+            'source_fingerprints': {},
+            'built': set(),
+            'skipped': set()
+        }
+        logger.info(f"Refresh run id: {run['run_id']}")
+        if run['only'] is not None:
+            logger.info(f"Limiting the refresh to: {', '.join(sorted(run['only']))}")
+        with profile_step(connection, run, 'refresh'):
+            run_refresh_steps(connection, run)
 
     except Exception as e:
         logger.error(f"Failed to refresh materialized views: {e}", exc_info=True)
         raise
 
+def run_refresh_steps(connection, run: dict) -> None:
+    """Build, swap, validate and clean up the views for one refresh run."""
+    # Step 1: Store current totals for validation (base views only)
+    logger.info("Recording current totals...")
+    old_totals = {}
+    for matview, config in BASE_MATVIEWS.items():
+        old_totals[matview] = get_matview_total(connection, matview, config)
+
+    # Steps 2 & 3: Create all new base and dependent views, independent ones concurrently
+    if any(config.get('refresh_type') == 'dune' for config in BASE_MATVIEWS.values()):
+        if not os.environ.get('DUNE_API_KEY'):
+            raise ValueError("DUNE_API_KEY environment variable is required")
+
+    logger.info(f"Creating new materialized views with up to {MAX_PARALLEL_BUILDS} workers...")
+    try:
+        build_matviews_in_parallel(run['graph'], run)
+    finally:
+        close_worker_connections()
+
+    if run['skipped']:
+        logger.info(f"Skipped unchanged views: {', '.join(sorted(run['skipped']))}")
+    if not run['built']:
+        logger.info("All views are up to date, nothing to swap")
+        refresh_time_rollups(connection, run)
+        return
+
+    # Keep config order so base views are swapped before their dependents
+    built_views = [
+        matview for matview in list(BASE_MATVIEWS) + list(DEPENDENT_MATVIEWS)
+        if matview in run['built']
+    ]
+
+    # Step 4: Atomic swap of all rebuilt views. Moving a relation between schemas only
+    # touches the catalog; views keep reading their inputs wherever those are moved to
+    logger.info(f"Performing atomic swap of {len(built_views)} views...")
+    swap_commands = ["BEGIN;"]
+
+    for matview in built_views:
+        schema = get_matview_schema(matview)
+        swap_commands.extend([
+            f"DROP MATERIALIZED VIEW IF EXISTS {RETIRED_SCHEMA}.{matview} CASCADE;",
+            f"ALTER MATERIALIZED VIEW IF EXISTS {schema}.{matview} SET SCHEMA {RETIRED_SCHEMA};",
+            f"ALTER MATERIALIZED VIEW {STAGING_SCHEMA}.{matview} SET SCHEMA {schema};"
+        ])
+
+    swap_commands.append("COMMIT;")
+
+
+    with profile_step(connection, run, 'swap'):
+        execute_command(connection, "\n".join(swap_commands))
+    record_view_fingerprints(connection, run)
+
+    logger.info("=== POST-SWAP HEALTH CHECK ===")
+    check_view_exists(connection, 'experimental_views', 'allo_gmv_leaderboard_events')
+
+    # Step 5: Validate
+    logger.info("Validating refreshed views...")
+    with profile_step(connection, run, 'validate'):
+        for matview in built_views:
+            if matview in BASE_MATVIEWS:
+                validate_refresh(connection, matview, BASE_MATVIEWS[matview], old_totals[matview])
+            else:
+                schema = get_matview_schema(matview)
+                new_total = get_matview_total(connection, matview, DEPENDENT_MATVIEWS[matview], schema)
+                logger.info(f"New dependent view {schema}.{matview} total: {new_total}")
+
+    logger.info("=== PRE-CLEANUP HEALTH CHECK ===")
+    check_view_exists(connection, 'experimental_views', 'allo_gmv_leaderboard_events')
+
+    # Step 6: Cleanup
+    logger.info("Cleaning up old views...")
+    cleanup_commands = []
+    for matview in built_views:
+        cmd = f"DROP MATERIALIZED VIEW IF EXISTS {RETIRED_SCHEMA}.{matview} CASCADE;"
+        cleanup_commands.append(cmd)
+        logger.info(f"Adding cleanup command for view: {cmd}")
+
+    # Before executing them all
+    logger.info("About to execute cleanup commands:")
+    for cmd in cleanup_commands:
+        logger.info(f"Will execute: {cmd}")
+
+    with profile_step(connection, run, 'cleanup'):
+        execute_command(connection, "\n".join(cleanup_commands))
+
+    logger.info("=== POST-CLEANUP HEALTH CHECK ===")
+    check_view_exists(connection, 'experimental_views', 'allo_gmv_leaderboard_events')
+
+    # Step 7: Roll the promoted views up into hourly and daily buckets
+    refresh_time_rollups(connection, run)
+
 def main():
     """Main execution function."""
     connection = None
     start_time = time.time()
     
-    # Add argument parsing
+    parser = argparse.ArgumentParser(description="Refresh the materialized views in the Grants DB.")
+    parser.add_argument(
+        '--full-refresh',
+        action='store_true',
+        default=os.environ.get('MATVIEW_FULL_REFRESH', '').lower() in ('1', 'true'),
+        help="Rebuild every view, and rebuild incremental base views from scratch instead of merging new rows."
+    )
+    parser.add_argument(
+        '--explain',
+        action='store_true',
+        default=os.environ.get('MATVIEW_PROFILE_EXPLAIN', '').lower() in ('1', 'true'),
+        help="Also store EXPLAIN (ANALYZE, BUFFERS) of each rebuilt view. Runs every view query twice."
+    )
+    parser.add_argument(
+        '--only',
+        action='append',
+        metavar='VIEW',
+        help="Only refresh this view plus the views upstream and downstream of it. Can be repeated."
+    )
+    parser.add_argument(
+        '--report',
+        action='store_true',
+        help="Print the latest run's steps next to their median over the previous runs, then exit."
+    )
+    args = parser.parse_args()
     
     try:
         connection = get_connection()
-        refresh_materialized_views(connection)
+        if args.report:
+            with pd.option_context('display.max_rows', None, 'display.width', 200):
+                print(report_latest_run(connection).to_string(index=False))
+            return
+
+        refresh_materialized_views(
+            connection, full_refresh=args.full_refresh, explain=args.explain, only=args.only
+        )
         
         end_time = time.time()
         logger.info(f"Total refresh time: {end_time - start_time:.2f} seconds")
@@ -2,13 +2,12 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timezone
 import psycopg2 as pg
-import networkx as nx
-import itertools
-from collections import defaultdict
 import os
 import logging
 import hashlib
 from sqlalchemy import create_engine, text
+from project_normalization import normalize_project_attributes
+from watermarks import build_watermark_filter
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -47,8 +46,11 @@ def run_query(query):
         conn.close()
     return results
 
-def safe_upload_table(df, final_table_name, conn):
-    """Upload table with minimal downtime using temporary table"""
+def safe_upload_table(df, final_table_name, conn, key_columns=None):
+    """Upload table with minimal downtime using temporary table.
+
+    With key_columns, the table gets a unique index on them, which upload_table_diff needs.
+    """
     temp_table = f"{final_table_name}_temp"
     
     # Create SQLAlchemy engine from connection parameters
@@ -61,25 +63,160 @@ def safe_upload_table(df, final_table_name, conn):
     # Atomic swap
     with engine.connect() as connection:  # Use engine to create a connection
         with connection.begin():  # Start a transaction
+            if key_columns:
+                # Left unnamed, so it can't clash with the index of the table being replaced
+                key_list = ', '.join(f'"{column}"' for column in key_columns)
+                connection.execute(text(f"CREATE UNIQUE INDEX ON {temp_table} ({key_list});"))
             connection.execute(text(f"DROP TABLE IF EXISTS {final_table_name};"))  # Use text() to wrap the command
             connection.execute(text(f"ALTER TABLE {temp_table} RENAME TO {final_table_name};"))  # Use text() here as well
             logger.info(f"Successfully swapped tables: {temp_table} to {final_table_name}")
 
-def clean_github(url_or_name):
-    if pd.isna(url_or_name):
-        return np.nan
-    # Remove 'https://github.com/' if it's present
-    url_or_name = url_or_name.replace('https://github.com/', '').replace('http://github.com/', '')
-    if '/' in url_or_name:
-        # If it's a URL or a 'username/repo' string, split by '/' and take the first part
-        return url_or_name.split('/')[0].lower()
-    else:
-        # If it's a username, return it as is
-        return url_or_name.lower()
+def upload_table_diff(df, final_table_name, key_columns):
+    """Apply only the inserted, updated and deleted rows of df to an existing table.
+
+    df is uploaded to a staging table and merged in one transaction, so readers never see a
+    partial update and rows that didn't change aren't rewritten. The table is replaced instead
+    on the first upload, when its columns changed, or when it has no unique index on
+    key_columns. Without one, it may hold several rows per key, and merging would keep them all.
+    """
+    staging_table = f"{final_table_name}_staging"
+    engine = create_engine(f'postgresql://{user}:{password}@{host}:{port}/{dbname}')
 
-def generate_hash_group_id(group):
-    first_project_id = group['project_id'].iloc[0]  # Get the first project_id in the group
-    return hashlib.sha256(first_project_id.encode()).hexdigest()  # Generate the hash
+    with engine.connect() as connection:
+        existing_columns = [row[0] for row in connection.execute(text(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = 'public' AND table_name = :table"
+        ), {'table': final_table_name})]
+        has_unique_key = connection.execute(text("""
+            SELECT EXISTS (
+                SELECT 1
+                FROM pg_index i
+                WHERE i.indrelid = to_regclass(:table)
+                  AND i.indisunique
+                  AND i.indpred IS NULL
+                  AND (
+                      SELECT array_agg(a.attname::text ORDER BY a.attname::text COLLATE "C")
+                      FROM pg_attribute a
+                      WHERE a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+                  ) = CAST(:key_columns AS text[])
+            )
+        """), {'table': f'public.{final_table_name}', 'key_columns': sorted(key_columns)}).scalar()
+    if sorted(existing_columns) != sorted(df.columns) or not has_unique_key:
+        logger.info(f"{final_table_name} is missing, its columns changed or it has no unique key, replacing it")
+        safe_upload_table(df, final_table_name, None, key_columns)
+        return
+
+    df.to_sql(staging_table, engine, if_exists='replace', index=False)
+    columns = [f'"{column}"' for column in df.columns]
+    value_columns = [f'"{column}"' for column in df.columns if column not in key_columns]
+    key_match = ' AND '.join(f't."{column}" = s."{column}"' for column in key_columns)
+    with engine.connect() as connection:
+        with connection.begin():
+            merged = connection.execute(text(f"""
+                MERGE INTO {final_table_name} t
+                USING {staging_table} s ON {key_match}
+                WHEN MATCHED AND ({', '.join(f't.{column}' for column in value_columns)})
+                    IS DISTINCT FROM ({', '.join(f's.{column}' for column in value_columns)}) THEN
+                    UPDATE SET {', '.join(f'{column} = s.{column}' for column in value_columns)}
+                WHEN NOT MATCHED THEN
+                    INSERT ({', '.join(columns)}) VALUES ({', '.join(f's.{column}' for column in columns)});
+            """)).rowcount
+            deleted = connection.execute(text(f"""
+                DELETE FROM {final_table_name} t
+                WHERE NOT EXISTS (SELECT 1 FROM {staging_table} s WHERE {key_match});
+            """)).rowcount
+            connection.execute(text(f"DROP TABLE {staging_table};"))
+    logger.info(f"Merged {final_table_name}: {merged} rows inserted or updated, {deleted} deleted")
+
+def attribute_pairs(codes, max_bucket_size, new_from=0):
+    """Encode every pair of rows sharing an attribute value as row_1 * n + row_2 (row_1 < row_2).
+
+    codes holds one integer per row (-1 for missing), as returned by pd.factorize. Values
+    shared by more than max_bucket_size rows are skipped, since they don't tell projects apart
+    and would produce a quadratic number of pairs. Only pairs involving a row at or after
+    new_from are returned; pairs of older rows were counted by an earlier run.
+    """
+    n = len(codes)
+    rows = np.flatnonzero(codes >= 0)
+    values = codes[rows]
+    order = np.argsort(values, kind='stable')
+    rows, values = rows[order], values[order]
+    bucket_sizes = np.bincount(values)
+    buckets_with_new_rows = np.bincount(values[rows >= new_from], minlength=len(bucket_sizes)) > 0
+    keep = (bucket_sizes[values] > 1) & (bucket_sizes[values] <= max_bucket_size) & buckets_with_new_rows[values]
+    rows, values = rows[keep], values[keep]
+
+    # Rows are sorted by value, so rows d positions apart share a value only inside a bucket
+    # of more than d rows. Once no bucket is that large, there are no more pairs
+    pairs = []
+    for distance in range(1, max_bucket_size):
+        same_value = values[:-distance] == values[distance:]
+        if not same_value.any():
+            break
+        first, second = rows[:-distance][same_value], rows[distance:][same_value]
+        involves_new_row = np.maximum(first, second) >= new_from
+        first, second = first[involves_new_row], second[involves_new_row]
+        pairs.append(np.minimum(first, second) * n + np.maximum(first, second))
+    return np.concatenate(pairs) if pairs else np.empty(0, dtype=np.int64)
+
+class UnionFind:
+    """Disjoint sets over rows 0..n-1, backed by parent and rank arrays."""
+
+    def __init__(self, n, parent=None, rank=None):
+        """Start with every row in its own set, or continue from the saved parent and rank
+        arrays of the first rows."""
+        self.parent = np.arange(n, dtype=np.int64)
+        self.rank = np.zeros(n, dtype=np.int8)
+        if parent is not None:
+            self.parent[:len(parent)] = parent
+            self.rank[:len(rank)] = rank
+
+    def union(self, first, second):
+        """Merge the sets of first[k] and second[k] for every k."""
+        # Plain lists are much faster than NumPy arrays for element-wise access in a loop
+        parent = self.parent.tolist()
+        rank = self.rank.tolist()
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]  # Path halving
+                x = parent[x]
+            return x
+
+        for a, b in zip(np.asarray(first).tolist(), np.asarray(second).tolist()):
+            root_a, root_b = find(a), find(b)
+            if root_a == root_b:
+                continue
+            if rank[root_a] < rank[root_b]:
+                root_a, root_b = root_b, root_a
+            parent[root_b] = root_a
+            if rank[root_a] == rank[root_b]:
+                rank[root_a] += 1
+
+        self.parent = np.array(parent, dtype=np.int64)
+        self.rank = np.array(rank, dtype=np.int8)
+
+    def roots(self):
+        """The root of every row's set, flattening the parent array on the way."""
+        roots = self.parent
+        while True:
+            grandparents = roots[roots]
+            if np.array_equal(grandparents, roots):
+                break
+            roots = grandparents
+        self.parent = roots
+        return roots
+
+def load_grouping_state():
+    """Rows grouped by earlier runs with their union-find parent and rank, or None on the first run."""
+    exists = run_query(f"SELECT to_regclass('{grouping_state_table}') IS NOT NULL AS state_exists")
+    if not exists['state_exists'][0]:
+        return None
+    return run_query(f'SELECT * FROM {grouping_state_table} ORDER BY row_position')
+
+def generate_hash_group_id(first_project_id):
+    """Derive a group's id from its earliest project_id, so it survives regrouping."""
+    return hashlib.sha256(first_project_id.encode()).hexdigest()
 
 
 cgrants_query = '''
@@ -93,7 +230,8 @@ cgrants_query = '''
         cg.createdon AS created_at,
         ad.amount_donated, 
         ad.last_donation,
-        'cGrants' as source
+        'cGrants' as source,
+        'cgrants:' || cg.grantid AS row_key
     FROM
         public."cgrantsGrants" cg
     LEFT JOIN (
@@ -108,6 +246,7 @@ cgrants_query = '''
     ) ad ON cg.grantid = ad.grant_id;
     '''
 
+# {watermark_filter} is filled in with str.replace, since the JSON paths contain braces too
 indexer_query = '''
     SELECT
         project_id,
@@ -118,7 +257,21 @@ indexer_query = '''
         metadata #>> '{application, recipient}' AS payout_address,
         TO_TIMESTAMP(CAST((metadata #>> '{application, project, createdAt}') AS bigint)/1000) AS "created_at",
         total_amount_donated_in_usd AS "amount_donated",
-        'indexer' AS source
+        'indexer' AS source,
+        chain_id::text || ':' || round_id || ':' || id AS row_key,
+        chain_id,
+        created_at_block
+    FROM
+        applications
+    WHERE 
+        chain_id != 11155111 AND {watermark_filter};
+    '''
+
+# Donation totals of applications keep changing after they were grouped
+indexer_amounts_query = '''
+    SELECT
+        chain_id::text || ':' || round_id || ':' || id AS row_key,
+        total_amount_donated_in_usd AS "amount_donated"
     FROM
         applications
     WHERE 
@@ -128,87 +281,113 @@ indexer_query = '''
 manual_links = run_query('SELECT * FROM manual_project_links') # a table with two columns: project_id_1, project_id_2
 # Set the minimum number of shared attributes required to draw an edge
 min_shared_attributes = 3  # Number of shared attributes required to draw an edge
-
-cgrants_data = run_query(cgrants_query)
-indexer_data = run_query(indexer_query)
-cgrants_data['project_id'] = cgrants_data['project_id'].astype(str)
-data = pd.concat([cgrants_data, indexer_data], ignore_index=True)
-
-# Pre-cleaning
-eth_address_pattern = r'^0x[a-fA-F0-9]{40}$'
-data['payout_address'] = data['payout_address'].astype(str)
-data['payout_address'] = data['payout_address'].str.lower()
-data = data[data['payout_address'].str.match(eth_address_pattern)]
-data['title'] = data['title'].astype(str)
-data['title'] = data['title'].str.lower()
-data['title'] = data['title'].str.replace(r'[^\w\s]', '', regex=True)  # Remove punctuation
-data['title'] = data['title'].str.replace(r'\s+', ' ', regex=True)  # Replace multiple spaces with a single space
-data['title'] = data['title'].str.strip()  # Remove leading/trailing whitespace
-data['project_twitter'] = data['project_twitter'].str.lower()
-data['project_github'] = data['project_github'].astype(str)
-data['project_github'] = data['project_github'].str.lower()
-data['project_github'] = data['project_github'].apply(clean_github)
-data['website'] = data['website'].str.rstrip('/')
-data.replace('nan', np.nan, inplace=True)
-# Convert empty strings to NaN and drop them
-data['title'].replace('', np.nan, inplace=True)
-data.dropna(subset=['title'], inplace=True)
-logger.info("Dropped rows with empty titles")
-
-# Reset group_id 
-data['group_id'] = 0
-logger.info("Reset group_id to 0 for all rows")
-
-# Create a graph
-G = nx.Graph()
-# Add nodes
-for i, row in data.iterrows():
-    G.add_node(i)
-logger.info("Added nodes to the graph")
-
-# First, create edges for matching project_ids and manual links
-project_groups = data.groupby('project_id')
-for _, group in project_groups:
-    if len(group) > 1:
-        # Create edges between all rows with the same project_id
-        for i1, i2 in itertools.combinations(group.index, 2):
-            G.add_edge(i1, i2)
+# Attribute values shared by more applications than this (a common title, a multisig payout
+# address) are ignored when counting shared attributes
+max_attribute_bucket_size = 500
+
+# Rows grouped so far, with the union-find state. Later runs only pull and match indexer
+# applications created at or after the last seen block of their chain; cGrants never changes.
+# Set PROJECT_GROUPS_FULL_REBUILD=true after changing the matching rules above
+grouping_state_table = 'project_grouping_state'
+state = load_grouping_state()
+if state is None or os.environ.get('PROJECT_GROUPS_FULL_REBUILD', 'false').lower() == 'true':
+    logger.info("Grouping all projects from scratch")
+    state = None
+    cgrants_data = run_query(cgrants_query)
+    indexer_data = run_query(indexer_query.replace('{watermark_filter}', 'TRUE'))
+    cgrants_data['project_id'] = cgrants_data['project_id'].astype(str)
+    data = pd.concat([cgrants_data, indexer_data], ignore_index=True)
+else:
+    indexer_state = state[state['source'] == 'indexer']
+    last_blocks = indexer_state.groupby('chain_id')['created_at_block'].max().dropna()
+    watermarks = {int(chain_id): int(block) for chain_id, block in last_blocks.items()}
+    data = run_query(indexer_query.replace('{watermark_filter}', build_watermark_filter('created_at_block', watermarks)))
+    # Applications from the watermark block itself, or without a block, may already be grouped
+    data = data[~data['row_key'].isin(state['row_key'])]
+    logger.info(f"Grouping {len(data)} new applications into {len(state)} grouped rows")
+data['created_at_block'] = pd.to_numeric(data['created_at_block'], errors='coerce')
+
+# Pre-cleaning: rows without a valid payout address or a title can't be matched
+data = normalize_project_attributes(data)
+data = data.dropna(subset=['payout_address', 'title'])
+logger.info("Dropped rows without a valid payout address or a title")
+
+# New rows go after the grouped ones, so row positions in the saved state stay valid
+grouped_rows = 0 if state is None else len(state)
+if state is not None:
+    data = pd.concat([state.drop(columns=['row_position', 'parent', 'rank']), data], ignore_index=True)
+data.reset_index(drop=True, inplace=True)  # Row labels double as positions in the pair codes below
+
+# Every new row starts in its own group; rows are merged through the edges below
+if state is None:
+    groups = UnionFind(len(data))
+else:
+    groups = UnionFind(len(data), state['parent'].to_numpy(), state['rank'].to_numpy())
+previous_roots = groups.roots()[:grouped_rows].copy()
+
+# First, create edges for matching project_ids and manual links. Linking each row to the
+# first row with the same project_id joins them all
+project_codes, project_ids = pd.factorize(data['project_id'])
+rows_with_id = np.flatnonzero(project_codes >= 0)
+first_rows = np.full(len(project_ids), len(data), dtype=np.int64)
+np.minimum.at(first_rows, project_codes[rows_with_id], rows_with_id)
+groups.union(rows_with_id, first_rows[project_codes[rows_with_id]])
 logger.info("Created edges for matching project_ids")
 
-# Create edges for manual links
-for _, row in manual_links.iterrows():
-    project_id_1 = row['project_id_1']
-    project_id_2 = row['project_id_2']
-    # Find the indices of the rows with the given project_ids
-    index_1 = data[data['project_id'] == project_id_1].index[0]
-    index_2 = data[data['project_id'] == project_id_2].index[0]
-    G.add_edge(index_1, index_2)
-logger.info("Created edges for manual links")
-
-# Then continue with the attribute matching logic
-shared_attributes_counter = defaultdict(int)
+# Create edges for manual links, resolving both project_ids to the first row with that id.
+# A linked project may have been dropped by the pre-cleaning, so unresolved links are reported
+project_codes_1 = project_ids.get_indexer(manual_links['project_id_1'].astype(str))
+project_codes_2 = project_ids.get_indexer(manual_links['project_id_2'].astype(str))
+resolved = (project_codes_1 >= 0) & (project_codes_2 >= 0)
+groups.union(first_rows[project_codes_1[resolved]], first_rows[project_codes_2[resolved]])
+for _, link in manual_links[~resolved].iterrows():
+    logger.warning(f"Skipping manual link {link['project_id_1']} - {link['project_id_2']}: project not found")
+logger.info(f"Created edges for {int(resolved.sum())} of {len(manual_links)} manual links")
+
+# Then continue with the attribute matching logic. A pair appears once per attribute it
+# shares, so counting the encoded pairs gives the number of shared attributes
+pair_codes = []
 for attribute in ['title', 'website', 'payout_address', 'project_twitter', 'project_github']:
-    attribute_data = data.dropna(subset=[attribute])
-    for _, group in attribute_data.groupby(attribute):
-        for i1, i2 in itertools.combinations(group.index, 2):
-            pair = tuple(sorted((i1, i2)))
-            shared_attributes_counter[pair] += 1
-logger.info("Counted shared attributes for edges")
+    codes, uniques = pd.factorize(data[attribute])
+    skipped = int((np.bincount(codes[codes >= 0], minlength=len(uniques)) > max_attribute_bucket_size).sum())
+    if skipped:
+        logger.info(f"Ignoring {skipped} {attribute} values shared by more than {max_attribute_bucket_size} rows")
+    pair_codes.append(attribute_pairs(codes, max_attribute_bucket_size, new_from=grouped_rows))
+pairs, shared_counts = np.unique(np.concatenate(pair_codes), return_counts=True)
+logger.info(f"Counted shared attributes for {len(pairs)} pairs")
 
 # Add edges for pairs with at least min_shared_attributes shared attributes
-for pair, count in shared_attributes_counter.items():
-    if count >= min_shared_attributes:
-        G.add_edge(*pair)
+matched_pairs = pairs[shared_counts >= min_shared_attributes]
+groups.union(matched_pairs // len(data), matched_pairs % len(data))
 logger.info(f"Added edges for pairs with at least {min_shared_attributes} shared attributes")
 
-group_id = 0
-for component in nx.connected_components(G):
-    data.loc[list(component), 'group_id'] = group_id
-    group_id += 1
-
-data['group_id'] = data['group_id'].astype(str)
-
-logger.info(f"Count of groups: {group_id}")
+# Name each group after its earliest created project, so ids only change when groups merge
+data['group_id'] = groups.roots()
+first_projects = data.sort_values(by=['created_at', 'project_id']).drop_duplicates(subset='group_id')
+group_ids = dict(zip(first_projects['group_id'], first_projects['project_id'].astype(str).map(generate_hash_group_id)))
+data['group_id'] = data['group_id'].map(group_ids)
+
+logger.info(f"Count of groups: {data['group_id'].nunique()}")
+
+# The delta of this run: new rows, and grouped rows whose group was merged into another
+roots = groups.roots()
+changed_rows = np.concatenate([
+    np.flatnonzero(roots[:grouped_rows] != previous_roots),
+    np.arange(grouped_rows, len(data))
+])
+logger.info(f"{len(changed_rows)} rows in {len(np.unique(roots[changed_rows]))} groups changed since the last run")
+
+# Refresh the donation totals of grouped indexer applications
+if state is not None:
+    amounts = run_query(indexer_amounts_query).drop_duplicates('row_key').set_index('row_key')['amount_donated']
+    is_indexer = data['source'] == 'indexer'
+    data.loc[is_indexer, 'amount_donated'] = data.loc[is_indexer, 'row_key'].map(amounts).fillna(data.loc[is_indexer, 'amount_donated'])
+
+# Save the rows and the union-find state for the next run
+grouping_state = data.drop(columns=['group_id'])
+grouping_state['row_position'] = np.arange(len(data))
+grouping_state['parent'] = groups.parent
+grouping_state['rank'] = groups.rank
 
 # Create a DataFrame of the latest group information
 group_info = data.copy()
@@ -266,21 +445,29 @@ project_groups_summary = project_groups_summary[[
 project_groups_summary.reset_index(drop=True, inplace=True)
 logger.info("Combined first and latest information for project groups summary")
 
-# Upload project_lookup
-project_lookup = data[['group_id', 'project_id', 'source']]
+# Upload project_lookup. A project applying to several rounds has one row per application
+# in data, but all of them are in the same group
+project_lookup = data[['group_id', 'project_id', 'source']].drop_duplicates(subset=['project_id', 'source'])
 project_lookup = project_lookup.sort_values(by='group_id')
 conn = pg.connect(host=host, port=port, dbname=dbname, user=user, password=password)
 try:
-    safe_upload_table(project_lookup, 'project_lookup', conn)
+    upload_table_diff(project_lookup, 'project_lookup', ['project_id', 'source'])
     logger.info("Successfully uploaded project_lookup table")
 except Exception as e:
     logger.error(f"Failed to upload project_lookup: {e}")
 
 # Upload project_groups_summary
 try:
-    safe_upload_table(project_groups_summary, 'project_groups_summary', conn)
+    upload_table_diff(project_groups_summary, 'project_groups_summary', ['group_id'])
     logger.info("Successfully uploaded project_groups_summary table")
 except Exception as e:
     logger.error(f"Failed to upload project_groups_summary: {e}")
+
+# Both uploads are computed from the whole grouping, so a failed one is caught up by the next run
+try:
+    safe_upload_table(grouping_state, grouping_state_table, conn)
+    logger.info(f"Successfully saved {grouping_state_table}")
+except Exception as e:
+    logger.error(f"Failed to save {grouping_state_table}: {e}")
 finally:
     conn.close()
@@ -0,0 +1,26 @@
+"""Per-chain high-water marks for pulling only new rows across postgres_fdw.
+
+Shared by update_materialized_views.py and update_project_groups.py, which both keep the
+highest block (or other watermark column) they have seen per chain.
+"""
+from decimal import Decimal
+from typing import Dict
+
+
+def build_watermark_filter(column: str, watermarks: Dict[int, Decimal]) -> str:
+    """Build a WHERE clause selecting rows at or past each chain's watermark.
+
+    Constants are inlined so postgres_fdw pushes the filter down to the source database.
+    Chains without a watermark yet are pulled in full. Rows without a value in the
+    watermark column can't be placed relative to it, so they are pulled on every run.
+    """
+    if not watermarks:
+        return "TRUE"
+    clauses = [
+        f"(chain_id = {int(chain_id)} AND {column} >= {Decimal(watermark)})"
+        for chain_id, watermark in sorted(watermarks.items())
+    ]
+    known_chains = ', '.join(str(int(chain_id)) for chain_id in sorted(watermarks))
+    clauses.append(f"chain_id NOT IN ({known_chains})")
+    clauses.append(f"{column} IS NULL")
+    return "(" + " OR ".join(clauses) + ")"